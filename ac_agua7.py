@@ -1,8 +1,11 @@
+import os
+
 import streamlit as st
+import pandas as pd
 import geopandas as gpd
-import plotly.express as px
+import plotly.graph_objects as go
+import streamlit.components.v1 as components
 import folium
-from streamlit_folium import st_folium
 
 import geopandas as gpd
 
@@ -28,40 +31,65 @@ st.title("💧 PMSB de Augusto Corrêa - PA: Consumo de Água")
 # -----------------------
 # FUNÇÃO PARA CARREGAR POLÍGONOS DO GEOJSON
 # -----------------------
-@st.cache_data
+GEOJSON_PATH = "BD_CONSUMO_AGUA_AC.geojson"
+PARQUET_PATH = "BD_CONSUMO_AGUA_AC.parquet"  # gerado por gerar_cache_dados.py
+
+@st.cache_resource
 def load_poligonos():
-    # agora lê direto o geojson
-    gdf = gpd.read_file("BD_CONSUMO_AGUA_AC.geojson")
-    gdf = gdf.to_crs(epsg=4326)
-    gdf["AREA_y"] = gdf["AREA_y"].fillna("Não informado")
-    gdf["BAIRRO_COM"] = gdf["BAIRRO_COM"].fillna("Não informado")
+    # GeoParquet pré-convertido (já em EPSG:4326) evita reparsear o geojson;
+    # só vale se não for mais antigo que o geojson (senão gerar_cache_dados.py não foi rodado)
+    if os.path.exists(PARQUET_PATH) and (
+        not os.path.exists(GEOJSON_PATH)
+        or os.path.getmtime(PARQUET_PATH) >= os.path.getmtime(GEOJSON_PATH)
+    ):
+        gdf = gpd.read_parquet(PARQUET_PATH)
+    else:
+        gdf = gpd.read_file(GEOJSON_PATH)
+        gdf = gdf.to_crs(epsg=4326)
+    # categóricas: filtros (==, isin) comparam códigos inteiros e as categorias já vêm ordenadas
+    gdf["AREA_y"] = gdf["AREA_y"].fillna("Não informado").astype("category")
+    gdf["BAIRRO_COM"] = gdf["BAIRRO_COM"].fillna("Não informado").astype("category")
+    # centróides fixos: calculados uma vez para o centro do mapa
+    centroides = gdf.geometry.centroid
+    gdf["_cx"] = centroides.x
+    gdf["_cy"] = centroides.y
     return gdf
 
 gdf = load_poligonos()
 
+def _filter_mask(area: str, bairros) -> pd.Series:
+    mask = pd.Series(True, index=gdf.index)
+    if area != "Todas":
+        mask &= gdf["AREA_y"] == area
+    if bairros:
+        mask &= gdf["BAIRRO_COM"].isin(bairros)
+    return mask
+
+@st.cache_data(max_entries=32)
+def _filtered_geojson(area: str, bairros: tuple[str, ...]) -> str:
+    # GeoJSON serializado por filtro; só leva as colunas usadas no tooltip
+    sel = gdf.loc[_filter_mask(area, bairros)]
+    return sel[["geometry", "AREA_y", "BAIRRO_COM"]].to_json()
+
 # -----------------------
 # FILTROS DEPENDENTES COM MULTI-SELEÇÃO
 # -----------------------
 col1, col2 = st.columns(2)
 
 with col1:
-    area = st.selectbox("Área", ["Todas"] + sorted(gdf["AREA_y"].unique().tolist()))
+    area = st.selectbox("Área", ["Todas"] + gdf["AREA_y"].cat.categories.tolist())
 
 # bairros dependem da área escolhida
 if area != "Todas":
     bairros_disponiveis = gdf[gdf["AREA_y"] == area]["BAIRRO_COM"].unique().tolist()
 else:
-    bairros_disponiveis = gdf["BAIRRO_COM"].unique().tolist()
+    bairros_disponiveis = gdf["BAIRRO_COM"].cat.categories.tolist()
 
 with col2:
     bairros_sel = st.multiselect("Bairro/Comunidade", sorted(bairros_disponiveis))
 
-# aplicar filtros nos polígonos
-df = gdf.copy()
-if area != "Todas":
-    df = df[df["AREA_y"] == area]
-if bairros_sel:
-    df = df[df["BAIRRO_COM"].isin(bairros_sel)]
+# aplicar filtros nos polígonos (sem copiar o gdf inteiro)
+df = gdf.loc[_filter_mask(area, bairros_sel)]
 
 # -----------------------
 # INDICADORES
@@ -79,37 +107,41 @@ with col2:
 st.markdown("### 📈 Indicadores de Consumo de Água")
 col1, col2 = st.columns(2)
 
-with col1:
-    fig1 = px.pie(df, names="LABEL_Q5", title="Fonte de água de abastecimento")
-    st.plotly_chart(fig1, use_container_width=True)
+PIE_MAX_CATEGORIAS = 20  # acima disso o restante vira "Outros"
 
-    fig2 = px.pie(df, names="LABEL_Q8", title="Entrega regular de água")
-    st.plotly_chart(fig2, use_container_width=True)
+def pie(dataframe, col, title):
+    vc = dataframe[col].fillna("Não informado").astype(str).value_counts()
+    if len(vc) > PIE_MAX_CATEGORIAS:
+        outros = pd.Series({"Outros": vc.iloc[PIE_MAX_CATEGORIAS:].sum()})
+        vc = pd.concat([vc.iloc[:PIE_MAX_CATEGORIAS], outros])
+    fig = go.Figure(go.Pie(labels=vc.index, values=vc.values))
+    fig.update_layout(title=title)
+    st.plotly_chart(fig, use_container_width=True)
 
-    fig3 = px.pie(df, names="LABEL_Q7", title="Problemas relacionados à água")
-    st.plotly_chart(fig3, use_container_width=True)
+with col1:
+    pie(df, "LABEL_Q5", "Fonte de água de abastecimento")
+    pie(df, "LABEL_Q8", "Entrega regular de água")
+    pie(df, "LABEL_Q7", "Problemas relacionados à água")
 
 with col2:
-    fig4 = px.pie(df, names="LABEL_Q6", title="Qualidade da água")
-    st.plotly_chart(fig4, use_container_width=True)
-
-    fig5 = px.pie(df, names="LABEL_Q9", title="Falta de água")
-    st.plotly_chart(fig5, use_container_width=True)
-
-    fig6 = px.pie(df, names="LABEL_Q10", title="Poço próximo de fossa séptica")
-    st.plotly_chart(fig6, use_container_width=True)
+    pie(df, "LABEL_Q6", "Qualidade da água")
+    pie(df, "LABEL_Q9", "Falta de água")
+    pie(df, "LABEL_Q10", "Poço próximo de fossa séptica")
 
 # -----------------------
 # MAPA
 # -----------------------
 st.markdown("### 🗺️ Mapa das Comunidades")
 
-if not df.empty:
-    center = [df.geometry.centroid.y.mean(), df.geometry.centroid.x.mean()]
+@st.cache_data(max_entries=32)
+def _map_html(area: str, bairros: tuple[str, ...]) -> str:
+    # mapa só de leitura: HTML renderizado uma vez por filtro, sem o canal de eventos do st_folium
+    sel = gdf.loc[_filter_mask(area, bairros)]
+    center = [sel["_cy"].mean(), sel["_cx"].mean()]
     m = folium.Map(location=center, zoom_start=11, tiles="cartodbpositron")
 
     folium.GeoJson(
-        data=df.to_json(),
+        data=_filtered_geojson(area, bairros),
         name="Polígonos",
         style_function=lambda x: {
             "fillColor": "#1f78b4",
@@ -124,11 +156,14 @@ if not df.empty:
     ).add_to(m)
 
     # zoom para o filtro aplicado
-    bounds = df.total_bounds  # [minx, miny, maxx, maxy]
+    bounds = sel.total_bounds  # [minx, miny, maxx, maxy]
     m.fit_bounds([[bounds[1], bounds[0]], [bounds[3], bounds[2]]])
 
     folium.LayerControl().add_to(m)
-    st_folium(m, width=900, height=600)
+    return folium.Figure().add_child(m).render()
+
+if not df.empty:
+    components.html(_map_html(area, tuple(sorted(bairros_sel))), width=900, height=610)
 else:
     st.warning("⚠️ Nenhum polígono encontrado para os filtros selecionados.")
 
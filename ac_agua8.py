@@ -4,7 +4,7 @@ from pathlib import Path
 
 import streamlit as st
 import pandas as pd
-import plotly.express as px
+import plotly.graph_objects as go
 import folium
 from streamlit_folium import st_folium
 
@@ -183,9 +183,9 @@ def pie(dataframe, col, title):
     if col not in dataframe.columns:
         st.warning(f"Coluna ausente: {col}")
         return
-    tmp = dataframe.copy()
-    tmp[col] = tmp[col].fillna("Não informado").astype(str)
-    fig = px.pie(tmp, names=col, title=title)
+    vc = dataframe[col].fillna("Não informado").astype(str).value_counts()
+    fig = go.Figure(go.Pie(labels=vc.index, values=vc.values))
+    fig.update_layout(title=title)
     st.plotly_chart(fig, use_container_width=True)
 
 with col1:
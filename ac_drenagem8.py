@@ -1,12 +1,21 @@
 import os
 import json
+import pickle
 from pathlib import Path
 
 import streamlit as st
+import numpy as np
 import pandas as pd
-import plotly.express as px
+import shapely
+from shapely.geometry import shape
+import plotly.graph_objects as go
+import streamlit.components.v1 as components
 import folium
-from streamlit_folium import st_folium
+
+try:
+    import orjson  # parser de JSON bem mais rápido (opcional)
+except ImportError:
+    orjson = None
 
 
 # -----------------------
@@ -17,6 +26,8 @@ st.title("💧 PMSB de Augusto Corrêa - PA: Drenagem")
 
 # Caminho do GeoJSON (na mesma pasta do script)
 DATA_PATH = Path(__file__).parent / "BD_BAIRROS_E_ZONA_RURAL_CONSUMO_ALL_DRENAGEM.geojson"
+# FeatureCollection já parseado (gerado por gerar_cache_dados.py)
+CACHE_PATH = DATA_PATH.with_suffix(".pkl")
 
 
 # -----------------------
@@ -26,85 +37,77 @@ def _is_git_lfs_pointer(txt_head: str) -> bool:
     return "git-lfs.github.com/spec" in txt_head
 
 
-def _iter_coords(geom):
-    """Percorre coordenadas de vários tipos de geometria do GeoJSON."""
-    if not geom:
-        return
-    t = geom.get("type")
-    coords = geom.get("coordinates")
-    if t == "Point":
-        yield coords
-    elif t in ("MultiPoint", "LineString"):
-        for c in coords:
-            yield c
-    elif t in ("MultiLineString", "Polygon"):
-        for part in coords:
-            for c in part:
-                yield c
-    elif t == "MultiPolygon":
-        for poly in coords:
-            for ring in poly:
-                for c in ring:
-                    yield c
-    elif t == "GeometryCollection":
-        for g in geom.get("geometries", []):
-            yield from _iter_coords(g)
-
-
-def _bounds_from_geojson(gj: dict):
-    """Retorna (minx, miny, maxx, maxy) do FeatureCollection."""
-    xs, ys = [], []
-    for feat in gj.get("features", []):
-        for x, y in _iter_coords(feat.get("geometry")):
-            xs.append(x)
-            ys.append(y)
-    if not xs or not ys:
+def _read_geojson(path: Path) -> dict:
+    """Lê o FeatureCollection com orjson quando disponível (senão, json da stdlib)."""
+    if orjson is not None:
+        return orjson.loads(path.read_bytes())
+    with path.open("r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _geoms_from_geojson(gj: dict) -> np.ndarray:
+    """Converte as geometrias dos features em shapely (array paralelo aos features)."""
+    feats = gj.get("features", [])
+    geoms = np.empty(len(feats), dtype=object)
+    for i, feat in enumerate(feats):
+        geom = feat.get("geometry")
+        geoms[i] = shape(geom) if geom else None
+    return geoms
+
+
+def _bounds_from_geoms(geoms: np.ndarray):
+    """Retorna (minx, miny, maxx, maxy) de um array de geometrias shapely."""
+    if len(geoms) == 0:
+        return None
+    b = shapely.bounds(geoms)  # geometria ausente/vazia -> NaN
+    if np.isnan(b).all():
         return None
-    return min(xs), min(ys), max(xs), max(ys)
-
-
-def _filter_geojson(gj: dict, area: str, bairros_sel: list):
-    """Filtra o FeatureCollection considerando campos ausentes como 'Não informado'."""
-    def norm(v, default="Não informado"):
-        if v is None:
-            return default
-        if isinstance(v, str) and v.strip() in ("", "nan", "None"):
-            return default
-        return v
-
-    def cond(props):
-        area_val = norm(props.get("AREA_y"))
-        bairro_val = norm(props.get("BAIRRO_COM"))
-        if area != "Todas" and area_val != area:
-            return False
-        if bairros_sel and bairro_val not in bairros_sel:
-            return False
-        return True
-
-    feats = [f for f in gj.get("features", []) if cond(f.get("properties", {}))]
+    minx, miny = np.nanmin(b[:, 0]), np.nanmin(b[:, 1])
+    maxx, maxy = np.nanmax(b[:, 2]), np.nanmax(b[:, 3])
+    return float(minx), float(miny), float(maxx), float(maxy)
+
+
+def _filter_mask(df_all: pd.DataFrame, area: str, bairros_sel: list) -> np.ndarray:
+    """Máscara booleana dos filtros sobre as colunas já normalizadas de df_all."""
+    mask = np.ones(len(df_all), dtype=bool)
+    if area != "Todas":
+        mask &= (df_all["AREA_y"] == area).to_numpy()
+    if bairros_sel:
+        mask &= df_all["BAIRRO_COM"].isin(bairros_sel).to_numpy()
+    return mask
+
+
+def _filter_geojson(features_arr: np.ndarray, mask: np.ndarray):
+    """Monta o FeatureCollection filtrado (features_arr tem uma entrada por linha de df_all)."""
+    feats = features_arr[mask].tolist()
     return {"type": "FeatureCollection", "features": feats}
 
 
 # -----------------------
 # CARREGAMENTO DE DADOS
 # -----------------------
-@st.cache_data(show_spinner="Carregando dados...")
-def load_data(geojson_path: Path):
+@st.cache_resource(show_spinner="Carregando dados...")
+def load_data(geojson_path: Path, cache_path: Path = CACHE_PATH):
     if not geojson_path.exists():
         raise FileNotFoundError(
             f"Arquivo não encontrado: {geojson_path.name}. "
             "Coloque o BD_BAIRROS_E_ZONA_RURAL_CONSUMO_ALL_DRENAGEM.geojson na raiz do app."
         )
 
-    head = geojson_path.read_text(encoding="utf-8", errors="ignore")[:200]
+    with geojson_path.open("r", encoding="utf-8", errors="ignore") as f:
+        head = f.read(200)
     if _is_git_lfs_pointer(head):
         raise RuntimeError(
             "O GeoJSON parece ser um 'pointer' do Git LFS. "
             "Remova do LFS e faça commit do arquivo real no Git."
         )
 
-    with geojson_path.open("r", encoding="utf-8") as f:
-        gj = json.load(f)
+    # pickle só vale se não for mais antigo que o geojson (senão está desatualizado)
+    if cache_path.exists() and cache_path.stat().st_mtime >= geojson_path.stat().st_mtime:
+        with cache_path.open("rb") as f:
+            gj = pickle.load(f)
+    else:
+        gj = _read_geojson(geojson_path)
 
     # DataFrame com as propriedades dos features
     props_list = [feat.get("properties", {}) for feat in gj.get("features", [])]
@@ -117,17 +120,24 @@ def load_data(geojson_path: Path):
             df[c] = "Não informado"
         df[c] = df[c].fillna("Não informado").astype(str)
 
+    # categóricas: filtros (==, isin) comparam códigos inteiros e as categorias já vêm ordenadas
+    for c in ["AREA_y", "BAIRRO_COM"]:
+        df[c] = df[c].astype("category")
+
     num_cols = ["N_domi", "pop_estim1"]
     for c in num_cols:
         if c not in df.columns:
             df[c] = 0
         df[c] = pd.to_numeric(df[c], errors="coerce").fillna(0)
 
-    return df, gj
+    features_arr = np.empty(len(props_list), dtype=object)
+    features_arr[:] = gj.get("features", [])
+
+    return df, features_arr, _geoms_from_geojson(gj)
 
 
 try:
-    df_all, geojson_all = load_data(DATA_PATH)
+    df_all, features_all, geoms_all = load_data(DATA_PATH)
 except Exception as e:
     st.error(f"Erro ao carregar dados: {e}")
     st.stop()
@@ -140,7 +150,7 @@ st.markdown("### 🔎 Filtros")
 col1, col2 = st.columns(2)
 
 with col1:
-    areas = ["Todas"] + sorted(df_all["AREA_y"].dropna().unique().tolist())
+    areas = ["Todas"] + df_all["AREA_y"].cat.categories.tolist()
     area = st.selectbox("Área", areas)
 
 if area != "Todas":
@@ -148,18 +158,15 @@ if area != "Todas":
         df_all.loc[df_all["AREA_y"] == area, "BAIRRO_COM"].dropna().unique().tolist()
     )
 else:
-    bairros_disponiveis = sorted(df_all["BAIRRO_COM"].dropna().unique().tolist())
+    bairros_disponiveis = df_all["BAIRRO_COM"].cat.categories.tolist()
 
 with col2:
     bairros_sel = st.multiselect("Bairro/Comunidade", bairros_disponiveis)
 
 
-# Aplica filtros no DataFrame
-df = df_all.copy()
-if area != "Todas":
-    df = df[df["AREA_y"] == area]
-if bairros_sel:
-    df = df[df["BAIRRO_COM"].isin(bairros_sel)]
+# Aplica filtros no DataFrame (sem copiar df_all)
+mask = _filter_mask(df_all, area, bairros_sel)
+df = df_all.loc[mask]
 
 
 # -----------------------
@@ -179,13 +186,18 @@ with col2:
 st.markdown("### 📈 Indicadores de Drenagem")
 col1, col2 = st.columns(2)
 
+PIE_MAX_CATEGORIAS = 20  # acima disso o restante vira "Outros"
+
 def pie(dataframe, col, title):
     if col not in dataframe.columns:
         st.warning(f"Coluna ausente: {col}")
         return
-    tmp = dataframe.copy()
-    tmp[col] = tmp[col].fillna("Não informado").astype(str)
-    fig = px.pie(tmp, names=col, title=title)
+    vc = dataframe[col].fillna("Não informado").astype(str).value_counts()
+    if len(vc) > PIE_MAX_CATEGORIAS:
+        outros = pd.Series({"Outros": vc.iloc[PIE_MAX_CATEGORIAS:].sum()})
+        vc = pd.concat([vc.iloc[:PIE_MAX_CATEGORIAS], outros])
+    fig = go.Figure(go.Pie(labels=vc.index, values=vc.values))
+    fig.update_layout(title=title)
     st.plotly_chart(fig, use_container_width=True)
 
 with col1:
@@ -204,10 +216,15 @@ with col2:
 # -----------------------
 st.markdown("### 🗺️ Mapa das Comunidades")
 
-geojson_filtered = _filter_geojson(geojson_all, area, bairros_sel)
+@st.cache_data(max_entries=32)
+def _map_html(area: str, bairros: tuple):
+    """HTML do mapa filtrado (None se não houver polígonos), renderizado uma vez por filtro."""
+    mask = _filter_mask(df_all, area, bairros)
+    geojson_filtered = _filter_geojson(features_all, mask)
+    if not geojson_filtered.get("features"):
+        return None
 
-if geojson_filtered.get("features"):
-    bounds = _bounds_from_geojson(geojson_filtered)
+    bounds = _bounds_from_geoms(geoms_all[mask])
     if bounds:
         minx, miny, maxx, maxy = bounds
         center = [(miny + maxy) / 2, (minx + maxx) / 2]
@@ -235,7 +252,14 @@ if geojson_filtered.get("features"):
         m.fit_bounds([[miny, minx], [maxy, maxx]])
 
     folium.LayerControl().add_to(m)
-    st_folium(m, width=900, height=600)
+    return folium.Figure().add_child(m).render()
+
+
+map_html = _map_html(area, tuple(sorted(bairros_sel)))
+
+if map_html:
+    # mapa só de leitura: dispensa o canal de eventos do st_folium
+    components.html(map_html, width=900, height=610)
 else:
     st.warning("⚠️ Nenhum polígono encontrado para os filtros selecionados.")
 
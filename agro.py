@@ -1,4 +1,6 @@
 # app.py
+import os
+
 import streamlit as st
 import pandas as pd
 import numpy as np
@@ -20,15 +22,25 @@ st.markdown("---")
 # ============================
 # Carregamento de dados
 # ============================
-@st.cache_data
-def load_data(path: str = "dados_agro.xlsx") -> pd.DataFrame:
-    df = pd.read_excel(path)
+@st.cache_data(persist="disk")
+def load_data(path: str = "dados_agro.xlsx", mtime: float = 0.0) -> pd.DataFrame:
+    # mtime entra na chave do cache em disco: planilha atualizada -> nova leitura
+    # Parquet gerado por gerar_cache_dados.py carrega bem mais rápido que o xlsx,
+    # mas só vale se não for mais antigo que a planilha
+    parquet_path = os.path.splitext(path)[0] + ".parquet"
+    if os.path.exists(parquet_path) and os.path.getmtime(parquet_path) >= mtime:
+        df = pd.read_parquet(parquet_path)
+    else:
+        df = pd.read_excel(path)
     # Padronizar nomes de colunas removendo espaços extras
     df.columns = [c.strip() for c in df.columns]
+    for c in ['Fazenda', 'Talhão']:
+        if c in df.columns:
+            df[c] = df[c].astype("category")
     return df
 
 try:
-    df = load_data("dados_agro.xlsx")
+    df = load_data("dados_agro.xlsx", os.path.getmtime("dados_agro.xlsx"))
 except Exception as e:
     st.error(f"❌ Não foi possível carregar 'dados_agro.xlsx': {e}")
     st.stop()
@@ -44,7 +56,7 @@ if not cols_necessarias.issubset(set(df.columns)):
 # ============================
 st.sidebar.header("🔍 Filtros")
 
-talhoes_disponiveis = ['Todos'] + sorted(map(str, df['Talhão'].dropna().unique().tolist()))
+talhoes_disponiveis = ['Todos'] + sorted(map(str, df['Talhão'].cat.categories.tolist()))
 talhao_selecionado = st.sidebar.selectbox(
     "🏞️ Selecione o Talhão",
     talhoes_disponiveis,
@@ -150,7 +162,8 @@ lon_max += 0.1 * lon_range
 
 lat_grid = np.linspace(lat_min, lat_max, resolucao_grade)
 lon_grid = np.linspace(lon_min, lon_max, resolucao_grade)
-lon_mesh, lat_mesh = np.meshgrid(lon_grid, lat_grid)
+# malha esparsa: (1, W) e (H, 1); o griddata faz o broadcast para a grade (H, W)
+lon_mesh, lat_mesh = np.meshgrid(lon_grid, lat_grid, sparse=True)
 
 # ============================
 # Interpolação com fallback
@@ -204,19 +217,26 @@ fig.add_trace(go.Heatmap(
     )
 ))
 
-# Pontos originais (agregados)
-fig.add_trace(go.Scatter(
-    x=lons,
-    y=lats,
+# Pontos originais (agregados) - acima do limite, só a camada de pontos é amostrada
+MAX_PONTOS_MAPA = 2000
+if len(lons) > MAX_PONTOS_MAPA:
+    idx = np.random.default_rng(0).choice(len(lons), MAX_PONTOS_MAPA, replace=False)
+    lons_pts, lats_pts, valores_pts = lons[idx], lats[idx], valores[idx]
+else:
+    lons_pts, lats_pts, valores_pts = lons, lats, valores
+
+fig.add_trace(go.Scattergl(
+    x=lons_pts,
+    y=lats_pts,
     mode='markers',
     marker=dict(
         size=9,
-        color=valores,
+        color=valores_pts,
         colorscale='Viridis',
         line=dict(width=1.5, color='white'),
         showscale=False
     ),
-    text=[f'{elemento_selecionado}: {v:.3f}' for v in valores],
+    text=np.char.add(f'{elemento_selecionado}: ', np.char.mod('%.3f', valores_pts)),
     hovertemplate='<b>Ponto</b><br>' +
                   'Longitude: %{x:.5f}<br>' +
                   'Latitude: %{y:.5f}<br>' +
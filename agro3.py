@@ -1,19 +1,29 @@
+import os
+import json
+import math
+
 import streamlit as st
 import pandas as pd
 import numpy as np
-from scipy.interpolate import griddata, Rbf
+from scipy.interpolate import griddata, RBFInterpolator
 
 # Mapas
 import folium
+from folium.plugins import FastMarkerCluster
 from streamlit_folium import st_folium
 import branca.colormap as bcm
-import matplotlib.cm as cm
-import matplotlib.colors as mcolors
+import matplotlib
 
 # Shapefile (limite)
 import geopandas as gpd
 from shapely import vectorized
 
+# Numba (opcional): acelera o IDW; sem ele usa a versão NumPy em blocos
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+
 # ============================
 # Config da página
 # ============================
@@ -37,6 +47,7 @@ def load_talhoes(path: str, talhao_col: str):
     if talhao_col not in gdf.columns:
         raise ValueError(f"A coluna '{talhao_col}' não existe no shapefile. Colunas: {list(gdf.columns)}")
     gdf["nome"] = gdf[talhao_col].astype(str)
+    gdf["_nome_norm"] = gdf["nome"].str.strip().str.lower()
     return gdf
 
 gdf_talhoes = None
@@ -49,14 +60,28 @@ except Exception as e:
 # ============================
 # Dados (Excel)
 # ============================
-@st.cache_data
-def load_data(path: str = "dados_agro.xlsx") -> pd.DataFrame:
-    df = pd.read_excel(path)
+@st.cache_data(persist="disk")
+def load_data(path: str = "dados_agro.xlsx", mtime: float = 0.0) -> pd.DataFrame:
+    # mtime entra na chave do cache em disco: planilha atualizada -> nova leitura
+    # Parquet gerado por gerar_cache_dados.py carrega bem mais rápido que o xlsx,
+    # mas só vale se não for mais antigo que a planilha
+    parquet_path = os.path.splitext(path)[0] + ".parquet"
+    if os.path.exists(parquet_path) and os.path.getmtime(parquet_path) >= mtime:
+        df = pd.read_parquet(parquet_path)
+    else:
+        df = pd.read_excel(path)
     df.columns = [c.strip() for c in df.columns]
+    for c in ['Fazenda', 'Talhão']:
+        if c in df.columns:
+            df[c] = df[c].astype("category")
+    if 'Talhão' in df.columns:
+        # chave normalizada para o filtro por igualdade (sem regex a cada rerun)
+        df["_talhao_norm"] = df['Talhão'].astype(str).str.strip().str.lower().astype("category")
     return df
 
 try:
-    df = load_data("dados_agro.xlsx")
+    dados_mtime = os.path.getmtime("dados_agro.xlsx")
+    df = load_data("dados_agro.xlsx", dados_mtime)
 except Exception as e:
     st.error(f"❌ Não foi possível carregar 'dados_agro.xlsx': {e}")
     st.stop()
@@ -70,7 +95,7 @@ if not cols_necessarias.issubset(df.columns):
 # Sidebar
 # ============================
 st.sidebar.header("🔍 Filtros")
-talhoes_disponiveis = ['Todos'] + sorted(map(str, df['Talhão'].dropna().unique().tolist()))
+talhoes_disponiveis = ['Todos'] + sorted(map(str, df['Talhão'].cat.categories.tolist()))
 talhao_selecionado = st.sidebar.selectbox("🏞️ Selecione o Talhão", talhoes_disponiveis)
 
 elementos_disponiveis = [e for e in ['N', 'Mg', 'Ca_Mg', 'P', 'pH', 'CTC'] if e in df.columns]
@@ -95,32 +120,43 @@ resolucao_grade = st.sidebar.slider("Resolução da Grade (nº de pixels por lad
 # ============================
 # Filtros e limpeza
 # ============================
-if talhao_selecionado == 'Todos':
-    df_filtrado = df.copy()
-else:
-    df_filtrado = df[df['Talhão'].astype(str).str.contains(str(talhao_selecionado), case=False, na=False)]
+col_lat, col_lon = 'Latitude', 'Longitude'
+
+@st.cache_data
+def _aggregate(talhao: str, elemento: str, mtime: float):
+    # filtro + limpeza + média por coordenada: só depende de (talhão, elemento) e da
+    # versão da planilha (mtime, a mesma chave do load_data), não do método nem da resolução
+    if talhao == 'Todos':
+        df_filtrado = df
+    else:
+        df_filtrado = df[df["_talhao_norm"] == talhao.strip().lower()]
+
+    df_clean = df_filtrado.dropna(subset=[col_lat, col_lon, elemento]).copy()
+    for c in [col_lat, col_lon, elemento]:
+        df_clean[c] = pd.to_numeric(df_clean[c], errors='coerce')
+    df_clean = df_clean.dropna(subset=[col_lat, col_lon, elemento])
+
+    df_agregado = df_clean.groupby([col_lat, col_lon], as_index=False)[elemento].mean()
+    lons = df_agregado[col_lon].to_numpy(dtype=float)
+    lats = df_agregado[col_lat].to_numpy(dtype=float)
+    valores = df_agregado[elemento].to_numpy(dtype=float)
+    return len(df_filtrado), df_clean, lons, lats, valores
+
+n_filtrado, df_clean, lons, lats, valores = _aggregate(str(talhao_selecionado), elemento_selecionado, dados_mtime)
 
-if df_filtrado.empty:
+if n_filtrado == 0:
     st.warning("⚠️ Nenhum dado encontrado para os filtros selecionados.")
     st.stop()
 
-col_lat, col_lon = 'Latitude', 'Longitude'
-df_clean = df_filtrado.dropna(subset=[col_lat, col_lon, elemento_selecionado]).copy()
-for c in [col_lat, col_lon, elemento_selecionado]:
-    df_clean[c] = pd.to_numeric(df_clean[c], errors='coerce')
-df_clean = df_clean.dropna(subset=[col_lat, col_lon, elemento_selecionado])
 if df_clean.empty:
     st.warning("⚠️ Dados insuficientes após limpeza para interpolação.")
     st.stop()
 
-df_agregado = df_clean.groupby([col_lat, col_lon], as_index=False)[elemento_selecionado].mean()
-
 # ============================
 # Métricas
 # ============================
 colA, colB, colC, colD, colE = st.columns(5)
-valores = df_agregado[elemento_selecionado].values
-with colA: st.metric("📊 Pontos válidos", len(df_agregado))
+with colA: st.metric("📊 Pontos válidos", len(valores))
 with colB: st.metric("📈 Máximo", f"{np.nanmax(valores):.3f}")
 with colC: st.metric("📉 Mínimo", f"{np.nanmin(valores):.3f}")
 with colD: st.metric("📊 Média", f"{np.nanmean(valores):.3f}")
@@ -129,18 +165,37 @@ with colE: st.metric("📏 Desvio Padrão", f"{np.nanstd(valores):.3f}")
 # ============================
 # Grade e máscara (limite)
 # ============================
-lats = df_agregado[col_lat].values
-lons = df_agregado[col_lon].values
 
 usar_mascara = (gdf_talhoes is not None) and (talhao_selecionado != 'Todos')
 
+@st.cache_resource
+def _poly_for_talhao(nome: str):
+    # união dos polígonos do talhão (e se foi encontrado no shapefile)
+    alvo = nome.strip().lower()
+    sel = gdf_talhoes["_nome_norm"] == alvo
+    if not sel.any():
+        # nomes do shapefile podem diferir da planilha: comparação leniente
+        sel = gdf_talhoes["_nome_norm"].str.contains(alvo, regex=False)
+    gdf_poly = gdf_talhoes[sel]
+    encontrado = not gdf_poly.empty
+    if not encontrado:
+        gdf_poly = gdf_talhoes.iloc[[0]]
+    return gdf_poly.geometry.unary_union, encontrado
+
+@st.cache_data
+def _mask_for_talhao(nome: str, res: int, minx: float, miny: float, maxx: float, maxy: float):
+    # mesma grade do app: máscara do limite por (talhão, resolução)
+    poly, _ = _poly_for_talhao(nome)
+    lon_grid = np.linspace(minx, maxx, res)
+    lat_grid = np.linspace(miny, maxy, res)
+    lon_mesh, lat_mesh = np.meshgrid(lon_grid, lat_grid, sparse=True)
+    return vectorized.contains(poly, lon_mesh, lat_mesh)
+
 poly = None
 if usar_mascara:
-    gdf_poly = gdf_talhoes[gdf_talhoes["nome"].astype(str).str.contains(str(talhao_selecionado), case=False, na=False)].copy()
-    if gdf_poly.empty:
+    poly, encontrado = _poly_for_talhao(str(talhao_selecionado))
+    if not encontrado:
         st.info("ℹ️ Talhão não encontrado no shapefile; usando o primeiro disponível.")
-        gdf_poly = gdf_talhoes.iloc[[0]].copy()
-    poly = gdf_poly.geometry.unary_union
     minx, miny, maxx, maxy = poly.bounds
 else:
     lat_min, lat_max = float(np.nanmin(lats)), float(np.nanmax(lats))
@@ -154,42 +209,101 @@ else:
 
 lat_grid = np.linspace(miny, maxy, resolucao_grade)
 lon_grid = np.linspace(minx, maxx, resolucao_grade)
-lon_mesh, lat_mesh = np.meshgrid(lon_grid, lat_grid)
+# malha esparsa: (1, W) e (H, 1) fazem broadcast para (H, W) sem materializar a grade
+lon_mesh, lat_mesh = np.meshgrid(lon_grid, lat_grid, sparse=True)
 
 if usar_mascara and poly is not None:
-    mask = vectorized.contains(poly, lon_mesh, lat_mesh)
+    mask = _mask_for_talhao(str(talhao_selecionado), resolucao_grade, minx, miny, maxx, maxy)
 else:
-    mask = np.ones_like(lon_mesh, dtype=bool)
+    mask = np.ones((lat_grid.size, lon_grid.size), dtype=bool)
 
 # ============================
 # Interpolação (apenas UM método, sem mistura)
 # ============================
-def idw_interpolation(x, y, z, xi, yi, power=2, eps=1e-12):
-    # x,y,z: 1D; xi,yi: 2D grids
+# Só as células dentro da máscara do limite são interpoladas; as demais ficam NaN.
+IDW_BLOCK_BYTES = 256 * 1024  # bloco (pontos x linhas x colunas) que cabe no cache L2
+
+if njit is not None:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _idw_kernel(x, y, z, xg, yg, mask, power, eps, out):
+        for j in prange(yg.shape[0]):
+            for i in range(xg.shape[0]):
+                if not mask[j, i]:
+                    out[j, i] = np.nan
+                    continue
+                acc_w = 0.0  # acumuladores em float64
+                acc_wz = 0.0
+                for p in range(x.shape[0]):
+                    dx = xg[i] - x[p]
+                    dy = yg[j] - y[p]
+                    d = np.sqrt(dx * dx + dy * dy) + eps
+                    if power == 2.0:
+                        w = 1.0 / (d * d)  # evita pow() no caso padrão
+                    else:
+                        w = d ** -power
+                    acc_w += w
+                    acc_wz += w * z[p]
+                out[j, i] = acc_wz / acc_w
+
+def idw_interpolation(x, y, z, xg, yg, mask, power=2, eps=1e-12, dtype=np.float32):
+    # x,y,z: 1D; xg,yg: eixos 1D da grade (lon_grid, lat_grid); mask: (H, W) -> superfície (H, W)
+    # FP32 basta para o mapa de cores; coordenadas relativas à origem da grade para não perder precisão
+    x0, y0 = xg[0], yg[0]
+    x = (x - x0).astype(dtype)
+    y = (y - y0).astype(dtype)
+    z = np.asarray(z).astype(dtype)
+    xg = (xg - x0).astype(dtype)
+    yg = (yg - y0).astype(dtype)
+    out = np.full((yg.size, xg.size), np.nan, dtype=dtype)
+    if njit is not None:
+        _idw_kernel(x, y, z, xg, yg, mask, dtype(power), dtype(eps), out)
+        return out
+    # sem Numba: blocos de linhas para não alocar o temporário (N, H, W) inteiro
     x = x.reshape(-1, 1, 1)
     y = y.reshape(-1, 1, 1)
-    z = z.reshape(-1, 1, 1)
-    dist = np.sqrt((xi - x) ** 2 + (yi - y) ** 2) + eps
-    w = 1.0 / (dist ** power)
-    zi = np.sum(w * z, axis=0) / np.sum(w, axis=0)
-    return zi
+    z = z.ravel()
+    chunk = max(1, IDW_BLOCK_BYTES // (out.itemsize * z.size * xg.size))
+    dx2 = (xg[None, None, :] - x) ** 2
+    for j0 in range(0, yg.size, chunk):
+        j1 = min(j0 + chunk, yg.size)
+        if not mask[j0:j1].any():
+            continue
+        dy = yg[None, j0:j1, None] - y
+        w = dx2 + dy * dy
+        np.sqrt(w, out=w)
+        w += eps
+        np.power(w, -power, out=w)
+        out[j0:j1] = np.einsum('p,pjk->jk', z, w) / w.sum(axis=0)
+    out[~mask] = np.nan
+    return out
+
+RBF_MAX_VIZINHOS = 50  # cada célula usa só os k pontos mais próximos (KD-tree)
+
+def rbf_interpolation(x, y, z, xi, yi, mask, eps):
+    # x,y,z: 1D; xi,yi: malhas (podem ser esparsas); mask: (H, W)
+    # RBFInterpolator usa epsilon como fator de escala (r * epsilon), o inverso do Rbf antigo (r / epsilon)
+    pts = np.column_stack([x, y])
+    rbf = RBFInterpolator(pts, z, kernel='multiquadric', epsilon=1.0 / eps,
+                          smoothing=0.0, neighbors=min(RBF_MAX_VIZINHOS, len(z)))
+    out = np.full(mask.shape, np.nan, dtype=np.result_type(z, xi))
+    xi, yi = np.broadcast_to(xi, mask.shape), np.broadcast_to(yi, mask.shape)
+    out[mask] = rbf(np.column_stack([xi[mask], yi[mask]]))
+    return out
 
 def compute_surface(method):
     if method == 'rbf (suave e extrapolada)':
         dx = float(maxx - minx)
         dy = float(maxy - miny)
         eps = max(dx, dy) / 25.0
-        rbf = Rbf(lons, lats, valores, function='multiquadric', epsilon=eps, smooth=0.0)
-        return rbf(lon_mesh, lat_mesh)
+        return rbf_interpolation(lons, lats, valores, lon_mesh, lat_mesh, mask, eps)
     elif method == 'idw (extrapolada)':
-        return idw_interpolation(lons, lats, valores, lon_mesh, lat_mesh, power=2)
+        return idw_interpolation(lons, lats, valores, lon_grid, lat_grid, mask, power=2)
     else:
         # fallback (não deve ocorrer): RBF
         dx = float(maxx - minx)
         dy = float(maxy - miny)
         eps = max(dx, dy) / 25.0
-        rbf = Rbf(lons, lats, valores, function='multiquadric', epsilon=eps, smooth=0.0)
-        return rbf(lon_mesh, lat_mesh)
+        return rbf_interpolation(lons, lats, valores, lon_mesh, lat_mesh, mask, eps)
 
 with st.spinner(f"🔄 Interpolando ({metodo_interpolacao}) {elemento_selecionado}..."):
     z = compute_surface(metodo_interpolacao)
@@ -200,20 +314,65 @@ z_masked = np.where(mask, z, np.nan)
 # ============================
 # Mapa – somente UMA camada de interpolação
 # ============================
-finite_vals = z_masked[np.isfinite(z_masked)]
-if finite_vals.size == 0:
+# máscara de valores válidos calculada uma vez (limites de cor e alfa)
+if njit is not None:
+    @njit(parallel=True, cache=True)  # sem fastmath: isfinite precisa ver os NaN
+    def _finite_stats_kernel(z, finite_out):
+        vmin = np.inf
+        vmax = -np.inf
+        for j in prange(z.shape[0]):
+            for i in range(z.shape[1]):
+                v = z[j, i]
+                ok = math.isfinite(v)
+                finite_out[j, i] = ok
+                if ok:
+                    vmin = min(vmin, v)
+                    vmax = max(vmax, v)
+        return vmin, vmax
+
+def finite_stats(z):
+    # (máscara de finitos, vmin, vmax) numa única passada sobre a grade quando há Numba
+    if njit is not None:
+        finite_mask = np.empty(z.shape, dtype=np.bool_)
+        vmin, vmax = _finite_stats_kernel(z, finite_mask)
+        if not np.isfinite(vmin):
+            return finite_mask, None, None
+        return finite_mask, float(vmin), float(vmax)
+    finite_mask = np.isfinite(z)
+    if not finite_mask.any():
+        return finite_mask, None, None
+    return finite_mask, float(np.nanmin(z)), float(np.nanmax(z))
+
+finite_mask, vmin, vmax = finite_stats(z_masked)
+if vmin is None:
     vmin, vmax = 0.0, 1.0
-else:
-    vmin, vmax = float(np.nanmin(finite_vals)), float(np.nanmax(finite_vals))
-    if vmin == vmax:
-        vmax = vmin + 1e-9
+elif vmin == vmax:
+    vmax = vmin + 1e-9
+
+ALFA_OVERLAY = round(0.78 * 255)
 
-cmap = cm.get_cmap('viridis')
-norm = mcolors.Normalize(vmin=vmin, vmax=vmax)
+@st.cache_resource
+def _viridis_lut():
+    # tabela (256, 4) uint8 do viridis: cor de cada pixel vira um único gather
+    return (matplotlib.colormaps['viridis'](np.linspace(0, 1, 256)) * 255).astype(np.uint8)
 
-rgba = cmap(norm(z_masked))
-rgba[..., 3] = np.where(np.isfinite(z_masked), 0.78, 0.0)
-rgba = np.flipud(rgba)
+@st.cache_resource
+def _viridis_hex():
+    # cores da barra de legenda, derivadas da mesma LUT
+    return ['#%02x%02x%02x' % tuple(c) for c in _viridis_lut()[:, :3]]
+
+def _lut_index(v, vmin: float, vmax: float):
+    # índice 0..255 na LUT (mesma discretização do matplotlib: int(x * 256), limitado a 255)
+    idx = (v - vmin) * (256.0 / (vmax - vmin))
+    np.nan_to_num(idx, copy=False, nan=0.0)
+    np.clip(idx, 0, 255, out=idx)
+    return idx.astype(np.uint8)
+
+lut = _viridis_lut()
+
+# RGBA uint8 (4 bytes/pixel); o folium grava direto no PNG sem normalizar em float
+rgba_u8 = lut[_lut_index(z_masked, vmin, vmax)]
+rgba_u8[..., 3] = finite_mask * np.uint8(ALFA_OVERLAY)
 
 # centro do mapa
 if usar_mascara and poly is not None:
@@ -234,8 +393,9 @@ folium.TileLayer(
 
 # Único overlay de interpolação
 folium.raster_layers.ImageOverlay(
-    image=rgba,
+    image=rgba_u8,
     bounds=[[float(miny), float(minx)], [float(maxy), float(maxx)]],
+    origin="lower",  # linha 0 da grade = miny (o folium inverte ao gerar o PNG)
     name=f"{elemento_selecionado} (Interpolação)",
     opacity=1,
     interactive=False,
@@ -250,23 +410,46 @@ if usar_mascara and poly is not None:
         style_function=lambda x: {"color": "black", "weight": 3, "fill": False}
     ).add_to(m)
 
-# Pontos amostrais
-for la, lo, v in zip(lats, lons, valores):
-    folium.CircleMarker(
-        location=[float(la), float(lo)],
-        radius=5, weight=2, color="white",
-        fill=True, fill_color=mcolors.to_hex(cmap(norm(float(v)))),
-        fill_opacity=0.95,
-        tooltip=f"Ponto - {elemento_selecionado}: {float(v):.3f}",
-        popup=folium.Popup(
-            f"{elemento_selecionado}: {float(v):.3f}<br>Lat: {float(la):.5f}<br>Lon: {float(lo):.5f}",
-            max_width=240
-        ),
-    ).add_to(m)
+# Pontos amostrais - acima do limite, só a camada de pontos é amostrada
+MAX_PONTOS_MAPA = 2000
+if len(lons) > MAX_PONTOS_MAPA:
+    idx = np.random.default_rng(0).choice(len(lons), MAX_PONTOS_MAPA, replace=False)
+    lons_pts, lats_pts, valores_pts = lons[idx], lats[idx], valores[idx]
+else:
+    lons_pts, lats_pts, valores_pts = lons, lats, valores
+
+# cores calculadas de uma vez (sem to_hex por ponto)
+rgb_pts = lut[_lut_index(valores_pts, vmin, vmax), :3]
+cores_pts = ['#%02x%02x%02x' % tuple(c) for c in rgb_pts]
+dados_pts = [
+    [la, lo, cor, v]
+    for la, lo, cor, v in zip(lats_pts.tolist(), lons_pts.tolist(), cores_pts, valores_pts.tolist())
+]
+
+# marcadores montados no navegador (um único objeto Leaflet em vez de um por ponto)
+rotulo_js = json.dumps(elemento_selecionado)
+callback_pts = f"""function (row) {{
+    var v = row[3].toFixed(3);
+    var marker = L.circleMarker(new L.LatLng(row[0], row[1]), {{
+        radius: 5, weight: 2, color: "white",
+        fill: true, fillColor: row[2], fillOpacity: 0.95
+    }});
+    marker.bindTooltip("Ponto - " + {rotulo_js} + ": " + v);
+    marker.bindPopup({rotulo_js} + ": " + v + "<br>Lat: " + row[0].toFixed(5) +
+                     "<br>Lon: " + row[1].toFixed(5), {{maxWidth: 240}});
+    return marker;
+}}"""
+FastMarkerCluster(
+    dados_pts,
+    callback=callback_pts,
+    name="Pontos amostrais",
+    control=False,
+    disable_clustering_at_zoom=16,
+).add_to(m)
 
 # Barra de cores
 cbar = bcm.LinearColormap(
-    colors=[mcolors.to_hex(cmap(i)) for i in np.linspace(0, 1, 256)],
+    colors=_viridis_hex(),
     vmin=vmin, vmax=vmax
 )
 cbar.caption = elemento_selecionado
@@ -0,0 +1,58 @@
+"""
+Gera versões pré-processadas dos GeoJSON/planilhas usados pelos apps.
+
+Rodar uma vez (offline) sempre que um arquivo de dados for atualizado:
+
+    python gerar_cache_dados.py
+
+- GeoParquet (.parquet): lido por ac_agua7.py com gpd.read_parquet (leitura colunar).
+- FeatureCollection serializado (.pkl): lido por ac_drenagem8.py sem reparsear o JSON.
+- Parquet da planilha (.parquet): lido por agro.py/agro3.py no lugar do pd.read_excel.
+"""
+import json
+import pickle
+from pathlib import Path
+
+import pandas as pd
+import geopandas as gpd
+
+BASE_DIR = Path(__file__).parent
+
+PARQUET_SOURCES = ["BD_CONSUMO_AGUA_AC.geojson"]
+PICKLE_SOURCES = ["BD_BAIRROS_E_ZONA_RURAL_CONSUMO_ALL_DRENAGEM.geojson"]
+EXCEL_SOURCES = ["dados_agro.xlsx"]
+
+
+def geojson_to_parquet(src: Path) -> Path:
+    gdf = gpd.read_file(src).to_crs(epsg=4326)
+    dst = src.with_suffix(".parquet")
+    gdf.to_parquet(dst)
+    return dst
+
+
+def geojson_to_pickle(src: Path) -> Path:
+    with src.open("r", encoding="utf-8") as f:
+        gj = json.load(f)
+    dst = src.with_suffix(".pkl")
+    with dst.open("wb") as f:
+        pickle.dump(gj, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return dst
+
+
+def excel_to_parquet(src: Path) -> Path:
+    df = pd.read_excel(src)
+    dst = src.with_suffix(".parquet")
+    df.to_parquet(dst, index=False)
+    return dst
+
+
+if __name__ == "__main__":
+    for name in PARQUET_SOURCES:
+        dst = geojson_to_parquet(BASE_DIR / name)
+        print(f"✅ {name} -> {dst.name}")
+    for name in PICKLE_SOURCES:
+        dst = geojson_to_pickle(BASE_DIR / name)
+        print(f"✅ {name} -> {dst.name}")
+    for name in EXCEL_SOURCES:
+        dst = excel_to_parquet(BASE_DIR / name)
+        print(f"✅ {name} -> {dst.name}")
@@ -1,12 +1,19 @@
+import time
+
 import streamlit as st
+import numpy as np
 import pandas as pd
 import geopandas as gpd
+import shapely
 import plotly.express as px
 import plotly.graph_objects as go
-import plotly.io as pio
 from io import BytesIO
+from openpyxl import Workbook
 from datetime import datetime
 
+# recortes (.loc / seleção de colunas) sem cópias implícitas
+pd.options.mode.copy_on_write = True
+
 # Configuração da página com estilo moderno
 st.set_page_config(page_title="Painel de Postes", layout="wide", page_icon="⚡")
 
@@ -34,27 +41,172 @@ st.markdown("""
 st.markdown("<h1 class='dashboard-title'>⚡ Painel de Localização de Postes</h1>", unsafe_allow_html=True)
 st.markdown("<p class='dashboard-subtitle'>Visualização interativa de distribuição de postes por bairro, potência e tipo de lâmpada</p>", unsafe_allow_html=True)
 
+def _add_hover(df):
+    # texto do hover montado uma vez no carregamento; os filtros só fatiam esta coluna
+    if {'Bairro', 'Potência_', 'Lâmpada_A'}.issubset(df.columns):
+        df['_hover'] = (df['Bairro'].astype(str) + '<br>Potência: ' + df['Potência_'].astype(str) +
+                        '<br>Lâmpada: ' + df['Lâmpada_A'].astype(str))
+    return df
+
 # Função para carregar os dados com cache
 @st.cache_data(ttl=3600)  # Cache de 1 hora
 def load_poste_data():
     try:
         url = "https://raw.githubusercontent.com/silviogeo2022/streamlit_app_personal/main/Postes1.xlsx"
         urlgeo = "https://raw.githubusercontent.com/silviogeo2022/streamlit_app_personal/main/BAIRROS.shp"
-        df = pd.read_excel(url)
+        df = _add_hover(pd.read_excel(url))
         gdf_bairros = gpd.read_file(urlgeo)
         
         # Transformando sistemas de coordenadas
         gdf_bairros = gdf_bairros.to_crs(epsg=4326)
         
-        return df, gdf_bairros
+        # versao = marca da carga: vai como argumento (hasheado) dos caches derivados,
+        # que assim expiram junto com um novo download dos dados
+        return df, gdf_bairros, time.time()
     except Exception as e:
         st.error(f"Erro ao carregar dados: {str(e)}")
-        return None, None
+        return None, None, None
+
+MAX_PONTOS_MAPA = 5000
+COLUNAS_MAPA = ['Latitude', 'Longitude', '_hover']  # únicas usadas pelo mapa
+
+@st.cache_data
+def _bairro_outline_coords(_gdf_bairros, versao):
+    # Contornos de todos os bairros numa única linha, separados por NaN (quebra de linha no Plotly)
+    geoms = np.asarray(_gdf_bairros.geometry.values)
+    tipos = shapely.get_type_id(geoms)
+    geoms = geoms[(tipos == 3) | (tipos == 6)]  # Polygon / MultiPolygon
+    if geoms.size == 0:
+        return np.array([]), np.array([])
+
+    # Para multipolígonos, pegue o maior polígono
+    partes, dono = shapely.get_parts(geoms, return_index=True)
+    ordem = np.lexsort((-shapely.area(partes), dono))
+    primeiro = np.r_[True, dono[ordem][1:] != dono[ordem][:-1]]
+    aneis = shapely.get_exterior_ring(partes[ordem[primeiro]])
+
+    coords, anel = shapely.get_coordinates(aneis, return_index=True)
+    fim = np.r_[np.flatnonzero(np.diff(anel)) + 1, len(coords)]
+    coords = np.insert(coords, fim, np.nan, axis=0)
+    return coords[:, 0], coords[:, 1]
+
+def _chave_potencia(valor: str):
+    # ordena numericamente quando possível ("70" antes de "100")
+    try:
+        return (0, float(valor), valor)
+    except ValueError:
+        return (1, 0.0, valor)
+
+@st.cache_data(ttl=3600)
+def _opcoes_bairros(_df, versao):
+    # opções do seletor calculadas uma vez por carga dos dados, não a cada interação
+    return ["Nenhum"] + sorted(_df['Bairro'].unique().tolist())
+
+@st.cache_data(ttl=3600)
+def _opcoes_por_bairro(_df, versao, bairro):
+    # opções de potência e lâmpada disponíveis no bairro escolhido
+    sub = _df if bairro == "Nenhum" else _df[_df['Bairro'] == bairro]
+    potencias = ["Nenhum"] + sorted(map(str, sub['Potência_'].unique().tolist()), key=_chave_potencia)
+    lampadas = ["Nenhum"] + sorted(map(str, sub['Lâmpada_A'].unique().tolist()))
+    return potencias, lampadas
+
+@st.cache_data
+def _to_csv(df: pd.DataFrame) -> bytes:
+    return df.to_csv(index=False, sep=';').encode('utf-8')
+
+@st.cache_data
+def _to_xlsx(df: pd.DataFrame) -> bytes:
+    # planilha em modo write_only (linhas gravadas em sequência, sem objetos de célula)
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Sheet1")
+    ws.append([str(c) for c in df.columns])
+    for linha in df.astype(object).where(df.notna(), None).itertuples(index=False, name=None):
+        ws.append(linha)
+    buf = BytesIO()
+    wb.save(buf)
+    return buf.getvalue()
+
+def _filter_mask(df, bairro, potencia, lampada) -> np.ndarray:
+    # filtros combinados numa única máscara booleana (um só recorte do DataFrame)
+    mask = np.ones(len(df), dtype=bool)
+    if bairro != "Nenhum":
+        mask &= df['Bairro'].to_numpy() == bairro
+    if potencia != "Nenhum":
+        try:
+            potencia_valor = float(potencia) if '.' in potencia else int(potencia)
+        except ValueError:
+            potencia_valor = potencia
+        mask &= df['Potência_'].to_numpy() == potencia_valor
+    if lampada != "Nenhum":
+        mask &= df['Lâmpada_A'].astype(str).to_numpy() == lampada
+    return mask
+
+@st.cache_data(ttl=3600)
+def _agregacoes(_df_filtrado, versao, bairro, potencia, lampada):
+    # contagens dos gráficos de análise, refeitas só quando os filtros ou os dados mudam
+    df_bairros = _df_filtrado.groupby('Bairro', sort=False).size().reset_index(name='Quantidade de Postes')
+    df_potencia = _df_filtrado.groupby(['Bairro', 'Potência_']).size().reset_index(name='Contagem')
+    df_lampada = _df_filtrado.groupby(['Bairro', 'Lâmpada_A']).size().reset_index(name='Contagem')
+    return df_bairros, df_potencia, df_lampada
+
+# Função para criar mapa com limites
+# (figura em cache por carga dos dados e seleção de filtros; cor e tamanho dos pontos são aplicados depois)
+@st.cache_data(ttl=3600)
+def create_map_with_boundaries(_df_filtrado, _gdf_bairros, versao, bairro, potencia, lampada, show_boundaries):
+    df_filtrado, gdf_bairros = _df_filtrado, _gdf_bairros
+    # Criando o mapa base
+    fig = go.Figure()
+
+    # Adicionando os limites dos bairros (um único trace para todos)
+    if show_boundaries:
+        lons, lats = _bairro_outline_coords(gdf_bairros, versao)
+        if lons.size:
+            fig.add_trace(go.Scattermapbox(
+                mode="lines",
+                lon=lons,
+                lat=lats,
+                line=dict(width=2, color='red'),
+                opacity=0.5,
+                showlegend=False
+            ))
+
+    # Pontos de postes - acima do limite, só a camada do mapa é amostrada (contagens usam todos)
+    if len(df_filtrado) > MAX_PONTOS_MAPA:
+        df_mapa = df_filtrado.sample(MAX_PONTOS_MAPA, random_state=0)
+    else:
+        df_mapa = df_filtrado
+
+    # Adicionando os pontos de postes
+    fig.add_trace(go.Scattermapbox(
+        mode="markers",
+        lon=df_mapa['Longitude'],
+        lat=df_mapa['Latitude'],
+        text=df_mapa['_hover'].values,
+        marker=dict(opacity=0.7),
+        hoverinfo='text',
+        showlegend=False
+    ))
+
+    # Configurações de layout do mapa
+    fig.update_layout(
+        mapbox_style="open-street-map",
+        mapbox=dict(
+            center=dict(
+                lat=df_filtrado['Latitude'].mean(),
+                lon=df_filtrado['Longitude'].mean()
+            ),
+            zoom=13.3
+        ),
+        showlegend=False,
+        margin=dict(l=0, r=0, t=0, b=0),
+        height=550
+    )
+    return fig
 
 def main():
     # Carregar dados
     with st.spinner("Carregando dados dos postes..."):
-        df, gdf_bairros = load_poste_data()
+        df, gdf_bairros, versao_dados = load_poste_data()
     
     if df is not None and gdf_bairros is not None:
         colunas_necessarias = {'Latitude', 'Longitude', 'Bairro', 'Potência_', 'Lâmpada_A'}
@@ -66,33 +218,18 @@ def main():
             cor = st.sidebar.color_picker("Escolha a cor dos pontos", value="#1f77b4")
             
             # Filtro de Bairro
-            opcoes_bairros = ["Nenhum"] + sorted(df['Bairro'].unique().tolist())
+            opcoes_bairros = _opcoes_bairros(df, versao_dados)
             bairro_selecionado = st.sidebar.selectbox("Escolha o Bairro", options=opcoes_bairros)
             
-            # Aplicação do filtro de bairro
-            df_filtro_bairro = df if bairro_selecionado == "Nenhum" else df[df['Bairro'] == bairro_selecionado]
-            
             # Filtro de Potência
-            opcoes_potencia = ["Nenhum"] + sorted([str(x) for x in df_filtro_bairro['Potência_'].unique().tolist()])
+            opcoes_potencia, opcoes_lampada = _opcoes_por_bairro(df, versao_dados, bairro_selecionado)
             potencia_selecionada = st.sidebar.selectbox("Escolha a Potência", options=opcoes_potencia)
             
             # Filtro de Lâmpada (adicional)
-            opcoes_lampada = ["Nenhum"] + sorted([str(x) for x in df_filtro_bairro['Lâmpada_A'].unique().tolist()])
             lampada_selecionada = st.sidebar.selectbox("Lâmpada acessa 24h?", options=opcoes_lampada)
             
-            # Aplicação do filtro de potência
-            if potencia_selecionada != "Nenhum":
-                try:
-                    potencia_valor = float(potencia_selecionada) if '.' in potencia_selecionada else int(potencia_selecionada)
-                    df_filtrado = df_filtro_bairro[df_filtro_bairro['Potência_'] == potencia_valor]
-                except ValueError:
-                    df_filtrado = df_filtro_bairro[df_filtro_bairro['Potência_'] == potencia_selecionada]
-            else:
-                df_filtrado = df_filtro_bairro
-            
-            # Aplicação do filtro de lâmpada
-            if lampada_selecionada != "Nenhum":
-                df_filtrado = df_filtrado[df_filtrado['Lâmpada_A'].astype(str) == lampada_selecionada]
+            # Aplicação dos filtros de bairro, potência e lâmpada
+            df_filtrado = df.loc[_filter_mask(df, bairro_selecionado, potencia_selecionada, lampada_selecionada)]
             
             # Configurações adicionais
             show_boundaries = st.sidebar.checkbox("🗺️ Mostrar limites dos bairros", True)
@@ -107,77 +244,13 @@ def main():
                 > **Total de postes visualizados:** {len(df_filtrado)} postes
                 """)
                 
-                # Função para criar mapa com limites
-                def create_map_with_boundaries(df_filtrado, gdf_bairros):
-                    # Criando o mapa base
-                    fig = go.Figure()
-
-                    # Adicionando os limites dos bairros
-                    if show_boundaries:
-                        for _, bairro in gdf_bairros.iterrows():
-                            if bairro.geometry is not None:
-                                # Tratamento para diferentes tipos de geometria
-                                def extract_polygon_coords(geometry):
-                                    if geometry.geom_type == 'Polygon':
-                                        return list(geometry.exterior.coords)
-                                    elif geometry.geom_type == 'MultiPolygon':
-                                        # Para multipolígonos, pegue o maior polígono
-                                        largest_poly = max(geometry.geoms, key=lambda p: p.area)
-                                        return list(largest_poly.exterior.coords)
-                                    return []
-
-                                # Obtendo as coordenadas
-                                coords = extract_polygon_coords(bairro.geometry)
-                                
-                                if coords:
-                                    # Separando latitudes e longitudes com segurança
-                                    lons = [coord[0] for coord in coords]
-                                    lats = [coord[1] for coord in coords]
-                                    
-                                    # Adicionando o polígono do bairro
-                                    fig.add_trace(go.Scattermapbox(
-                                        mode="lines",
-                                        lon=lons,
-                                        lat=lats,
-                                        line=dict(width=2, color='red'),
-                                        opacity=0.5,
-                                        showlegend=False
-                                    ))
-
-                    # Adicionando os pontos de postes
-                    fig.add_trace(go.Scattermapbox(
-                        mode="markers",
-                        lon=df_filtrado['Longitude'],
-                        lat=df_filtrado['Latitude'],
-                        text=df_filtrado['Bairro'] + '<br>Potência: ' + df_filtrado['Potência_'].astype(str) + 
-                             '<br>Lâmpada: ' + df_filtrado['Lâmpada_A'].astype(str),
-                        marker=dict(
-                            size=point_size,
-                            color=cor,
-                            opacity=0.7
-                        ),
-                        hoverinfo='text',
-                        showlegend=False
-                    ))
-
-                    # Configurações de layout do mapa
-                    fig.update_layout(
-                        mapbox_style="open-street-map",
-                        mapbox=dict(
-                            center=dict(
-                                lat=df_filtrado['Latitude'].mean(),
-                                lon=df_filtrado['Longitude'].mean()
-                            ),
-                            zoom=13.3
-                        ),
-                        showlegend=False,
-                        margin=dict(l=0, r=0, t=0, b=0),
-                        height=550
-                    )
-                    return fig
 
                 # Criando o mapa
-                fig_mapa = create_map_with_boundaries(df_filtrado, gdf_bairros)
+                fig_mapa = create_map_with_boundaries(
+                    df_filtrado[COLUNAS_MAPA], gdf_bairros, versao_dados,
+                    bairro_selecionado, potencia_selecionada, lampada_selecionada, show_boundaries
+                )
+                fig_mapa.update_traces(selector=dict(mode="markers"), marker=dict(size=point_size, color=cor))
                 st.plotly_chart(fig_mapa, use_container_width=True)
                 
                 # Legenda
@@ -189,22 +262,26 @@ def main():
             
             with tab2:
                 st.subheader("Dados dos Postes")
+                colunas_dados = df_filtrado.columns.drop('_hover')
                 
                 # Opções de visualização
                 cols_to_show = st.multiselect(
                     "Selecione colunas para exibir",
-                    options=df_filtrado.columns,
+                    options=colunas_dados,
                     default=['Bairro', 'Potência_', 'Lâmpada_A', 'Latitude', 'Longitude']
                 )
                 
                 # Ordenação
-                sort_by = st.selectbox("Ordenar por", options=cols_to_show if cols_to_show else df_filtrado.columns, index=0)
+                sort_by = st.selectbox("Ordenar por", options=cols_to_show if cols_to_show else colunas_dados, index=0)
                 sort_order = st.radio("Ordem", options=['Ascendente', 'Descendente'], horizontal=True)
                 
-                display_df = df_filtrado.sort_values(
+                # projeta as colunas antes de ordenar: ordena e serializa só o que é exibido
+                display_df = df_filtrado[list(dict.fromkeys([*cols_to_show, sort_by]))].sort_values(
                     by=sort_by,
                     ascending=(sort_order == 'Ascendente')
-                )[cols_to_show]
+                )
+                if sort_by not in cols_to_show:
+                    display_df = display_df[cols_to_show]
                 
                 st.dataframe(display_df, use_container_width=True, height=400)
                 
@@ -214,16 +291,14 @@ def main():
                 with col1:
                     st.download_button(
                         "⬇️ Baixar como CSV",
-                        data=display_df.to_csv(index=False, sep=';'),
+                        data=_to_csv(display_df),
                         file_name="postes.csv",
                         mime="text/csv"
                     )
                 with col2:
-                    excel_buffer = BytesIO()
-                    display_df.to_excel(excel_buffer, index=False)
                     st.download_button(
                         "⬇️ Baixar como Excel",
-                        data=excel_buffer.getvalue(),
+                        data=_to_xlsx(display_df),
                         file_name="postes.xlsx",
                         mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
                     )
@@ -232,12 +307,13 @@ def main():
                 st.subheader("Análise Estatística")
                 
                 if not df_filtrado.empty:
+                    df_bairros, df_potencia, df_lampada = _agregacoes(
+                        df_filtrado, versao_dados, bairro_selecionado, potencia_selecionada, lampada_selecionada
+                    )
                     col1, col2 = st.columns(2)
                     
                     with col1:
                         # Gráfico de barras por bairro
-                        df_bairros = df_filtrado['Bairro'].value_counts().reset_index()
-                        df_bairros.columns = ['Bairro', 'Quantidade de Postes']
 
                         fig_barras_bairros = px.bar(df_bairros,
                                                    x='Bairro',
@@ -267,7 +343,6 @@ def main():
                     
                     with col2:
                         # Gráfico de barras por potência
-                        df_potencia = df_filtrado.groupby(['Bairro', 'Potência_']).size().reset_index(name='Contagem')
 
                         fig_barras_potencia = px.bar(df_potencia,
                                                     x='Bairro',
@@ -286,7 +361,6 @@ def main():
                         st.plotly_chart(fig_barras_potencia, use_container_width=True)
                         
                         # Gráfico de barras por lâmpada
-                        df_lampada = df_filtrado.groupby(['Bairro', 'Lâmpada_A']).size().reset_index(name='Contagem')
 
                         fig_barras_lampada = px.bar(df_lampada,
                                                    x='Bairro',
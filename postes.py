@@ -1,9 +1,15 @@
+import time
+
 import streamlit as st
+import numpy as np
 import pandas as pd
 import geopandas as gpd
+import shapely
 import plotly.express as px
 import plotly.graph_objects as go
-import plotly.io as pio
+
+# recortes (.loc / seleção de colunas) sem cópias implícitas
+pd.options.mode.copy_on_write = True
 
 # Configuração da página com layout amplo e redução de espaços
 st.set_page_config(layout="wide")
@@ -11,13 +17,146 @@ st.set_page_config(layout="wide")
 # Título com menos espaço após ele
 st.markdown("<h1 style='margin-bottom:0px;'>Painel de Localização de Postes</h1>", unsafe_allow_html=True)
 
-# Carregando os dados
-df = pd.read_excel("datasets\Postes1.xlsx")
-gdf_bairros = gpd.read_file("datasets\BAIRROS.shp")  # Carregue seu shapefile de bairros
+# Carregando os dados (em cache: não relê nem reprojeta a cada interação)
+def _add_hover(df):
+    # texto do hover montado uma vez no carregamento; os filtros só fatiam esta coluna
+    if {'Bairro', 'Potência_', 'Lâmpada_A'}.issubset(df.columns):
+        df['_hover'] = (df['Bairro'].astype(str) + '<br>Potência: ' + df['Potência_'].astype(str) +
+                        '<br>Lâmpada: ' + df['Lâmpada_A'].astype(str))
+    return df
+
+@st.cache_data(ttl=3600)  # Cache de 1 hora
+def _load_postes():
+    # versao = marca da carga: vai como argumento (hasheado) dos caches derivados,
+    # que assim expiram junto com uma nova leitura da planilha
+    return _add_hover(pd.read_excel("datasets\Postes1.xlsx")), time.time()
+
+@st.cache_resource
+def _load_bairros():
+    gdf = gpd.read_file("datasets\BAIRROS.shp")  # Carregue seu shapefile de bairros
+    # Converta para o mesmo sistema de coordenadas (por exemplo, EPSG:4326)
+    return gdf.to_crs(epsg=4326)
+
+df, versao_dados = _load_postes()
+gdf_bairros = _load_bairros()
+
+MAX_PONTOS_MAPA = 5000
+COLUNAS_MAPA = ['Latitude', 'Longitude', '_hover']  # únicas usadas pelo mapa
+
+@st.cache_data
+def _bairro_outline_coords(_gdf_bairros):
+    # Contornos de todos os bairros numa única linha, separados por NaN (quebra de linha no Plotly)
+    geoms = np.asarray(_gdf_bairros.geometry.values)
+    tipos = shapely.get_type_id(geoms)
+    geoms = geoms[(tipos == 3) | (tipos == 6)]  # Polygon / MultiPolygon
+    if geoms.size == 0:
+        return np.array([]), np.array([])
+
+    # Para multipolígonos, pegue o maior polígono
+    partes, dono = shapely.get_parts(geoms, return_index=True)
+    ordem = np.lexsort((-shapely.area(partes), dono))
+    primeiro = np.r_[True, dono[ordem][1:] != dono[ordem][:-1]]
+    aneis = shapely.get_exterior_ring(partes[ordem[primeiro]])
+
+    coords, anel = shapely.get_coordinates(aneis, return_index=True)
+    fim = np.r_[np.flatnonzero(np.diff(anel)) + 1, len(coords)]
+    coords = np.insert(coords, fim, np.nan, axis=0)
+    return coords[:, 0], coords[:, 1]
+
+def _chave_potencia(valor: str):
+    # ordena numericamente quando possível ("70" antes de "100")
+    try:
+        return (0, float(valor), valor)
+    except ValueError:
+        return (1, 0.0, valor)
 
-# Transformando sistemas de coordenadas se necessário
-# Converta para o mesmo sistema de coordenadas (por exemplo, EPSG:4326)
-gdf_bairros = gdf_bairros.to_crs(epsg=4326)
+@st.cache_data(ttl=3600)
+def _opcoes_bairros(_df, versao):
+    # opções do seletor calculadas uma vez por carga dos dados, não a cada interação
+    return ["Nenhum"] + sorted(_df['Bairro'].unique().tolist())
+
+@st.cache_data(ttl=3600)
+def _opcoes_potencia(_df, versao, bairro):
+    sub = _df if bairro == "Nenhum" else _df[_df['Bairro'] == bairro]
+    return ["Nenhum"] + sorted(map(str, sub['Potência_'].unique().tolist()), key=_chave_potencia)
+
+def _filter_mask(df, bairro, potencia) -> np.ndarray:
+    # filtros combinados numa única máscara booleana (um só recorte do DataFrame)
+    mask = np.ones(len(df), dtype=bool)
+    if bairro != "Nenhum":
+        mask &= df['Bairro'].to_numpy() == bairro
+    if potencia != "Nenhum":
+        try:
+            potencia_valor = float(potencia) if '.' in potencia else int(potencia)
+        except ValueError:
+            potencia_valor = potencia
+        mask &= df['Potência_'].to_numpy() == potencia_valor
+    return mask
+
+@st.cache_data(ttl=3600)
+def _agregacoes(_df_filtrado, versao, bairro, potencia):
+    # contagens dos gráficos de análise, refeitas só quando os filtros ou os dados mudam
+    df_bairros = _df_filtrado.groupby('Bairro', sort=False).size().reset_index(name='Quantidade de Postes')
+    df_potencia = _df_filtrado.groupby(['Bairro', 'Potência_']).size().reset_index(name='Contagem')
+    df_lampada = _df_filtrado.groupby(['Bairro', 'Lâmpada_A']).size().reset_index(name='Contagem')
+    return df_bairros, df_potencia, df_lampada
+
+# Preparando os dados para o mapa com limites de bairros
+# (figura em cache por carga dos dados e seleção de filtros; a cor dos pontos é aplicada depois)
+@st.cache_data(ttl=3600)
+def create_map_with_boundaries(_df_filtrado, _gdf_bairros, versao, bairro, potencia):
+    df_filtrado, gdf_bairros = _df_filtrado, _gdf_bairros
+    # Criando o mapa base
+    fig = go.Figure()
+
+    # Adicionando os limites dos bairros (um único trace para todos)
+    lons, lats = _bairro_outline_coords(gdf_bairros)
+    if lons.size:
+        fig.add_trace(go.Scattermapbox(
+            mode="lines",
+            lon=lons,
+            lat=lats,
+            line=dict(width=2, color='red'),
+            opacity=0.5,
+            showlegend=False  # Removendo legenda
+        ))
+
+    # Pontos de postes - acima do limite, só a camada do mapa é amostrada (contagens usam todos)
+    if len(df_filtrado) > MAX_PONTOS_MAPA:
+        df_mapa = df_filtrado.sample(MAX_PONTOS_MAPA, random_state=0)
+    else:
+        df_mapa = df_filtrado
+
+    # Adicionando os pontos de postes
+    fig.add_trace(go.Scattermapbox(
+        mode="markers",
+        lon=df_mapa['Longitude'],
+        lat=df_mapa['Latitude'],
+        text=df_mapa['_hover'].values,
+        marker=dict(
+            size=10,
+            opacity=0.7
+        ),
+        hoverinfo='text',
+        showlegend=False  # Removendo legenda
+    ))
+
+    # Configurações de layout do mapa
+    fig.update_layout(
+        mapbox_style="open-street-map",
+        mapbox=dict(
+            center=dict(
+                lat=df_filtrado['Latitude'].mean(),
+                lon=df_filtrado['Longitude'].mean()
+            ),
+            zoom=13.3
+        ),
+        showlegend=False,  # Removendo legenda
+        margin=dict(l=0, r=0, t=0, b=0),
+        height=550
+    )
+
+    return fig
 
 colunas_necessarias = {'Latitude', 'Longitude', 'Bairro', 'Potência_', 'Lâmpada_A'}
 if colunas_necessarias.issubset(df.columns):
@@ -25,97 +164,20 @@ if colunas_necessarias.issubset(df.columns):
     cor = st.sidebar.color_picker("Escolha a cor dos pontos", value="#1f77b4")
     
     # Filtro de Bairro
-    opcoes_bairros = ["Nenhum"] + sorted(df['Bairro'].unique().tolist())
+    opcoes_bairros = _opcoes_bairros(df, versao_dados)
     bairro_selecionado = st.sidebar.selectbox("Escolha o Bairro", options=opcoes_bairros)
     
-    # Aplicação do filtro de bairro
-    df_filtro_bairro = df if bairro_selecionado == "Nenhum" else df[df['Bairro'] == bairro_selecionado]
-    
     # Filtro de Potência
-    opcoes_potencia = ["Nenhum"] + sorted([str(x) for x in df_filtro_bairro['Potência_'].unique().tolist()])
+    opcoes_potencia = _opcoes_potencia(df, versao_dados, bairro_selecionado)
     potencia_selecionada = st.sidebar.selectbox("Escolha a Potência", options=opcoes_potencia)
     
-    # Aplicação do filtro de potência
-    if potencia_selecionada != "Nenhum":
-        try:
-            potencia_valor = float(potencia_selecionada) if '.' in potencia_selecionada else int(potencia_selecionada)
-            df_filtrado = df_filtro_bairro[df_filtro_bairro['Potência_'] == potencia_valor]
-        except ValueError:
-            df_filtrado = df_filtro_bairro[df_filtro_bairro['Potência_'] == potencia_selecionada]
-    else:
-        df_filtrado = df_filtro_bairro
-
-    # Preparando os dados para o mapa com limites de bairros
-    def create_map_with_boundaries(df_filtrado, gdf_bairros):
-        # Criando o mapa base
-        fig = go.Figure()
-
-        # Adicionando os limites dos bairros
-        for _, bairro in gdf_bairros.iterrows():
-            if bairro.geometry is not None:
-                # Tratamento para diferentes tipos de geometria
-                def extract_polygon_coords(geometry):
-                    if geometry.geom_type == 'Polygon':
-                        return list(geometry.exterior.coords)
-                    elif geometry.geom_type == 'MultiPolygon':
-                        # Para multipolígonos, pegue o maior polígono
-                        largest_poly = max(geometry.geoms, key=lambda p: p.area)
-                        return list(largest_poly.exterior.coords)
-                    return []
-
-                # Obtendo as coordenadas
-                coords = extract_polygon_coords(bairro.geometry)
-                
-                if coords:
-                    # Separando latitudes e longitudes com segurança
-                    lons = [coord[0] for coord in coords]
-                    lats = [coord[1] for coord in coords]
-                    
-                    # Adicionando o polígono do bairro
-                    fig.add_trace(go.Scattermapbox(
-                        mode="lines",
-                        lon=lons,
-                        lat=lats,
-                        line=dict(width=2, color='red'),
-                        opacity=0.5,
-                        showlegend=False  # Removendo legenda
-                    ))
-
-        # Adicionando os pontos de postes
-        fig.add_trace(go.Scattermapbox(
-            mode="markers",
-            lon=df_filtrado['Longitude'],
-            lat=df_filtrado['Latitude'],
-            text=df_filtrado['Bairro'] + '<br>Potência: ' + df_filtrado['Potência_'].astype(str) + 
-                 '<br>Lâmpada: ' + df_filtrado['Lâmpada_A'].astype(str),
-            marker=dict(
-                size=10,
-                color=cor,
-                opacity=0.7
-            ),
-            hoverinfo='text',
-            showlegend=False  # Removendo legenda
-        ))
-
-        # Configurações de layout do mapa
-        fig.update_layout(
-            mapbox_style="open-street-map",
-            mapbox=dict(
-                center=dict(
-                    lat=df_filtrado['Latitude'].mean(),
-                    lon=df_filtrado['Longitude'].mean()
-                ),
-                zoom=13.3
-            ),
-            showlegend=False,  # Removendo legenda
-            margin=dict(l=0, r=0, t=0, b=0),
-            height=550
-        )
+    # Aplicação dos filtros de bairro e potência
+    df_filtrado = df.loc[_filter_mask(df, bairro_selecionado, potencia_selecionada)]
 
-        return fig
 
     # Criando o mapa
-    fig_mapa = create_map_with_boundaries(df_filtrado, gdf_bairros)
+    fig_mapa = create_map_with_boundaries(df_filtrado[COLUNAS_MAPA], gdf_bairros, versao_dados, bairro_selecionado, potencia_selecionada)
+    fig_mapa.update_traces(selector=dict(mode="markers"), marker_color=cor)
     
     # Indicador de Quantidade de Postes
     total_pontos = len(df_filtrado)
@@ -144,11 +206,10 @@ if colunas_necessarias.issubset(df.columns):
     # Três gráficos abaixo do mapa - reduzindo espaço acima
     st.markdown('<div style="padding: 0px; margin-top: -20px;">', unsafe_allow_html=True)
     col1, col2, col3 = st.columns(3)
+    df_bairros, df_potencia, df_lampada = _agregacoes(df_filtrado, versao_dados, bairro_selecionado, potencia_selecionada)
     
     with col1:
         # Gráfico de barras por bairro
-        df_bairros = df_filtrado['Bairro'].value_counts().reset_index()
-        df_bairros.columns = ['Bairro', 'Quantidade de Postes']
 
         fig_barras_bairros = px.bar(df_bairros,
                                     x='Bairro',
@@ -168,7 +229,6 @@ if colunas_necessarias.issubset(df.columns):
     
     with col2:
         # Gráfico de barras por potência
-        df_potencia = df_filtrado.groupby(['Bairro', 'Potência_']).size().reset_index(name='Contagem')
 
         fig_barras_potencia = px.bar(df_potencia,
                                      x='Bairro',
@@ -188,7 +248,6 @@ if colunas_necessarias.issubset(df.columns):
     
     with col3:
         # Gráfico de barras por lâmpada
-        df_lampada = df_filtrado.groupby(['Bairro', 'Lâmpada_A']).size().reset_index(name='Contagem')
 
         fig_barras_lampada = px.bar(df_lampada,
                                     x='Bairro',
@@ -1,18 +1,28 @@
 # app.py
+import math
 import os
+import re
+import secrets
+import shutil
+import tempfile
 import traceback
-from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
-from datetime import datetime
-
-from flask import Flask, render_template, request, redirect, url_for, flash
+from concurrent.futures import ThreadPoolExecutor, wait
+from functools import lru_cache
+from pathlib import Path
+
+from flask import (
+    Flask, Request, Response, render_template, request, redirect, url_for, flash, jsonify,
+    stream_with_context,
+)
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import event, text
+from sqlalchemy import event, text, insert
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.engine import Engine, URL
 from sqlalchemy.sql import quoted_name, func
-from werkzeug.utils import secure_filename
+from werkzeug.utils import secure_filename as _secure_filename
 
 app = Flask(__name__)
-app.secret_key = os.getenv('FLASK_SECRET_KEY', 'dev-secret-key')  # necessário para flash
+app.secret_key = os.getenv('FLASK_SECRET_KEY', 'dev-secret-key')  # necessário para flash (fluxo HTML do /enviar)
 
 # ============ Config do Banco ============
 import os
@@ -32,6 +42,11 @@ CLIENT_ENCODING = os.getenv('CLIENT_ENCODING', 'UTF8')
 # ========= Config Flask-SQLAlchemy =========
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+    # pool por worker: conexões reaproveitadas entre requisições (sem reconectar a cada POST)
+    "pool_size": int(os.getenv('DB_POOL_SIZE', 20)),
+    "max_overflow": int(os.getenv('DB_MAX_OVERFLOW', 10)),
+    "pool_pre_ping": True,    # descarta conexões derrubadas pelo servidor antes de usar
+    "pool_recycle": 1800,     # renova conexões com mais de 30 min
     "connect_args": {"options": f"-c client_encoding={CLIENT_ENCODING}"}
 }
 
@@ -65,15 +80,70 @@ else:
 # ============ Uploads ============
 UPLOAD_DIR = os.path.join(app.root_path, 'static', 'uploads')
 os.makedirs(UPLOAD_DIR, exist_ok=True)
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
+ALLOWED_EXTENSIONS = frozenset({'png', 'jpg', 'jpeg', 'gif', 'webp'})
 app.config['UPLOAD_FOLDER'] = UPLOAD_DIR
+_UPLOAD = Path(UPLOAD_DIR)  # montado uma vez, fora do caminho das requisições
+# partes em trânsito ficam fora de static/ (não publicadas), no mesmo disco para o rename
+UPLOAD_TMP_DIR = os.path.join(app.root_path, 'uploads_tmp')
+os.makedirs(UPLOAD_TMP_DIR, exist_ok=True)
+_UPLOAD_TMP = Path(UPLOAD_TMP_DIR)
+# mkstemp cria 0600; a foto publicada volta ao modo padrão do umask (legível pelo Nginx/proxy)
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+FOTO_MODO = 0o666 & ~_UMASK
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB
-
+# Atrás de um proxy com X-Sendfile (Apache mod_xsendfile, lighttpd), USE_X_SENDFILE=1 faz o
+# proxy servir /static/uploads via sendfile(2) em vez do worker Python. Com Nginx, prefira um
+# alias direto:  location /static/uploads/ { alias <app>/static/uploads/; sendfile on; expires 7d; }
+app.config['USE_X_SENDFILE'] = os.getenv('USE_X_SENDFILE') == '1'
+
+class UploadRequest(Request):
+    # arquivos do multipart são gravados em UPLOAD_TMP_DIR; salvar vira um rename (sem cópia temp -> final)
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        tmp = tempfile.NamedTemporaryFile('wb+', dir=UPLOAD_TMP_DIR, suffix='.part', delete=False)
+        self.__dict__.setdefault('_uploads_tmp', []).append(tmp)
+        return tmp
+
+app.request_class = UploadRequest
+
+@app.teardown_request
+def remover_uploads_temporarios(exc):
+    # descarta partes de upload não aproveitadas (extensão inválida, formulário incompleto...)
+    for tmp in request.__dict__.get('_uploads_tmp', ()):
+        tmp.close()
+        if os.path.exists(tmp.name):
+            try:
+                os.remove(tmp.name)
+            except OSError:
+                pass
+
+def salvar_upload(foto_file, destino: Path):
+    stream = foto_file.stream
+    tmp_name = getattr(stream, 'name', None)
+    if isinstance(tmp_name, str) and Path(tmp_name).parent == _UPLOAD_TMP:
+        stream.close()
+        os.replace(tmp_name, destino)
+        os.chmod(destino, FOTO_MODO)
+    else:
+        with open(destino, 'wb') as dst:
+            shutil.copyfileobj(stream, dst, length=1024 * 1024)
+
+# grava a foto em paralelo ao INSERT (fallback de cópia pode levar o tempo de um disco lento)
+_IO_POOL = ThreadPoolExecutor(max_workers=int(os.getenv('UPLOAD_IO_WORKERS', 4)), thread_name_prefix='upload')
+
+# nomes de arquivo se repetem muito (IMG_0001.jpg...): memoriza a sanitização (regex)
+secure_filename = lru_cache(maxsize=4096)(_secure_filename)
+
+@lru_cache(maxsize=2048)
 def allowed_file(filename: str) -> bool:
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 # --------- Helpers para coordenadas ----------
-DEC6 = Decimal('0.000001')
+COORD_CASAS = 5  # ~1 m: além da precisão do GPS de celular; cabe em NUMERIC(9,6)
+# trechos entre separadores (vírgula, ponto e vírgula, barra vertical, espaços/tab)
+_COORD_TOKEN_RE = re.compile(r'[^,;|\s]+')
+# vírgula decimal e '−' (U+2212) -> '-' numa única passada
+_COORD_TRANS = str.maketrans({',': '.', '−': '-'})
 
 def parse_coord(value: str):
     if not value:
@@ -82,13 +152,15 @@ def parse_coord(value: str):
     if not s:
         return None
     # aceita vírgula decimal e vários caracteres de menos
-    s = s.replace(',', '.').replace('−', '-')  # '−' (U+2212) -> '-'
+    s = s.translate(_COORD_TRANS)
     try:
-        d = Decimal(s)
-        # normaliza para 6 casas decimais (cabe em NUMERIC(9,6))
-        return d.quantize(DEC6, rounding=ROUND_HALF_UP)
-    except InvalidOperation:
+        d = float(s)
+    except ValueError:
         return None
+    if not math.isfinite(d):
+        return None
+    # normaliza para COORD_CASAS casas decimais; float64 tem folga de sobra para NUMERIC(9,6)
+    return round(d, COORD_CASAS)
 
 def parse_coords_combined(value: str):
     """
@@ -99,16 +171,9 @@ def parse_coords_combined(value: str):
     """
     if not value:
         return None, None
-    s = value.strip()
-    if not s:
-        return None, None
 
-    # substitui separadores por espaço e quebra
-    for sep in [',', ';', '|', '\t', '  ']:
-        s = s.replace(sep, ' ')
-    s = ' '.join(s.split())  # compacta múltiplos espaços
-
-    parts = s.split(' ')
+    # uma única varredura: separa nos separadores e já descarta os vazios
+    parts = _COORD_TOKEN_RE.findall(value)
     if len(parts) < 2:
         return None, None
 
@@ -120,15 +185,18 @@ db = SQLAlchemy(app)
 
 @event.listens_for(Engine, "connect")
 def set_client_encoding(dbapi_connection, connection_record):
+    # client_encoding já vai nas opções de conexão (pacote de início); aqui resta só lc_messages,
+    # em autocommit: uma ida ao servidor e nenhuma transação aberta (ou abortada) na conexão nova
+    autocommit = dbapi_connection.autocommit
+    dbapi_connection.autocommit = True
     cur = dbapi_connection.cursor()
     try:
-        cur.execute(f"SET client_encoding TO '{CLIENT_ENCODING}';")
-        try:
-            cur.execute("SET lc_messages TO 'C';")
-        except Exception:
-            pass
+        cur.execute("SET lc_messages TO 'C';")
+    except Exception:
+        pass
     finally:
         cur.close()
+        dbapi_connection.autocommit = autocommit
 
 # ============ Modelo ============
 TABLE_NAME = os.getenv('TABLE_NAME', 'solicitacoes')
@@ -145,9 +213,17 @@ class Solicitacao(db.Model):
     latitude = db.Column(db.Numeric(9, 6), nullable=True)
     longitude = db.Column(db.Numeric(9, 6), nullable=True)
     foto_path = db.Column(db.Text, nullable=True)
-    situacoes = db.Column(db.Text, nullable=True)         # CSV: "buraco,iluminacao"
+    situacoes = db.Column(ARRAY(db.Text), nullable=True)  # TEXT[]: {buraco,iluminacao} (índice GIN)
     criado_em = db.Column('criado_em', db.DateTime(timezone=True), server_default=func.now())
 
+# INSERT direto (Core), sem a maquinaria de flush/identity map do ORM no POST
+INSERT_SQL = text(f'''
+    INSERT INTO "{DB_SCHEMA}"."{TABLE_NAME}"
+        (nome_rua, numero, bairro, latitude, longitude, foto_path, situacoes)
+    VALUES (:rua, :numero, :bairro, :latitude, :longitude, :foto_path, CAST(:situacoes AS TEXT[]))
+    RETURNING id
+''')
+
 # ============ Rotas ============
 @app.route('/')
 def index():
@@ -161,6 +237,10 @@ def index():
     #  - foto (input type="file")
     return render_template('formulario.html')
 
+def quer_json() -> bool:
+    """Cliente pediu JSON (fetch/XHR) em vez do fluxo flash + redirect do navegador."""
+    return request.accept_mimetypes.best_match(['text/html', 'application/json']) == 'application/json'
+
 @app.route('/enviar', methods=['POST'])
 def enviar_formulario():
     nome_rua = (request.form.get('nome_rua') or '').strip()
@@ -175,56 +255,149 @@ def enviar_formulario():
         lon = parse_coord(request.form.get('longitude'))
 
     situacoes_list = request.form.getlist('situacao')  # múltiplas checkboxes
-    situacoes_str = ','.join(situacoes_list) if situacoes_list else None
+    situacoes = [s for s in situacoes_list if s] or None  # vai direto para a coluna TEXT[]
 
     # upload da foto (input name="foto")
     foto_file = request.files.get('foto')
-    foto_path_rel = None
+    foto_path_rel = destino = None
     if foto_file and foto_file.filename and allowed_file(foto_file.filename):
         filename = secure_filename(foto_file.filename)
         base, ext = os.path.splitext(filename)
-        filename = f"{base}_{int(datetime.now().timestamp())}{ext}"
-        destino = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        foto_file.save(destino)
+        # sufixo aleatório: dois envios no mesmo segundo não sobrescrevem um ao outro
+        filename = f"{base}_{secrets.token_hex(6)}{ext}"
+        destino = _UPLOAD / filename
         foto_path_rel = f"/static/uploads/{filename}"
 
     if not nome_rua or not numero or not bairro:
+        # nada gravado: o temporário do upload é removido no teardown
+        if quer_json():
+            return jsonify(ok=False, erro='Preencha nome da rua, número e bairro.'), 400
         flash('Por favor, preencha nome da rua, número e bairro.', 'error')
         return redirect(url_for('index'))
 
+    # foto_path_rel já é conhecido: a gravação em disco corre junto com o INSERT
+    gravacao = _IO_POOL.submit(salvar_upload, foto_file, destino) if destino else None
     try:
-        nova = Solicitacao(
-            rua=nome_rua,
-            numero=str(numero),
-            bairro=bairro,
-            latitude=lat,
-            longitude=lon,
-            foto_path=foto_path_rel,
-            situacoes=situacoes_str
-        )
-        db.session.add(nova)
-        db.session.commit()
-        flash('Solicitação enviada com sucesso!', 'success')
+        with db.engine.begin() as conn:
+            new_id = conn.execute(INSERT_SQL, {
+                'rua': nome_rua,
+                'numero': str(numero),
+                'bairro': bairro,
+                'latitude': lat,
+                'longitude': lon,
+                'foto_path': foto_path_rel,
+                'situacoes': situacoes,
+            }).scalar_one()
+            if gravacao:
+                gravacao.result()  # falha ao gravar a foto desfaz o INSERT (commit só depois)
     except Exception as e:
-        db.session.rollback()
+        if gravacao:
+            wait([gravacao])
+            destino.unlink(missing_ok=True)  # sem linha no banco, sem foto órfã
         app.logger.exception("Erro ao salvar no banco")
+        if quer_json():
+            return jsonify(ok=False, erro=f'{type(e).__name__}: {e}'), 500
         flash(f'Erro ao salvar: {type(e).__name__}: {e}', 'error')
+        return redirect(url_for('index'))
 
+    # JSON: responde direto, sem cookie de sessão nem o GET extra do redirect
+    if quer_json():
+        return jsonify(ok=True, id=new_id), 201
+    flash('Solicitação enviada com sucesso!', 'success')
     return redirect(url_for('index'))
 
+def campo_json(item: dict, chave: str) -> str:
+    # só ausente/null vira vazio: 0 e 0.0 (JSON numérico) são valores válidos
+    valor = item.get(chave)
+    return '' if valor is None else str(valor).strip()
+
+@app.route('/bulk', methods=['POST'])
+def enviar_lote():
+    """
+    Importação em lote (JSON):
+    [{"nome_rua": ..., "numero": ..., "bairro": ...,
+      "coordenadas": "-2.05, -47.54" (ou "latitude"/"longitude"),
+      "situacoes": ["buraco", "iluminacao"]}, ...]
+    """
+    itens = request.get_json(silent=True)
+    if not isinstance(itens, list):
+        return jsonify(erro='Envie uma lista JSON de solicitações.'), 400
+
+    linhas, invalidos = [], []
+    for idx, item in enumerate(itens):
+        item = item if isinstance(item, dict) else {}
+        nome_rua = campo_json(item, 'nome_rua')
+        numero   = campo_json(item, 'numero')
+        bairro   = campo_json(item, 'bairro')
+        if not nome_rua or not numero or not bairro:
+            invalidos.append(idx)
+            continue
+
+        lat, lon = parse_coords_combined(campo_json(item, 'coordenadas'))
+        if lat is None and lon is None:
+            lat = parse_coord(campo_json(item, 'latitude'))
+            lon = parse_coord(campo_json(item, 'longitude'))
+
+        situacoes = item.get('situacoes')
+        if isinstance(situacoes, str):  # aceita ainda o formato antigo "buraco,iluminacao"
+            situacoes = situacoes.split(',')
+        if isinstance(situacoes, list):
+            situacoes = [s for s in map(str, situacoes) if s.strip()] or None
+        else:
+            situacoes = None
+
+        linhas.append({
+            'rua': nome_rua, 'numero': numero, 'bairro': bairro,
+            'latitude': lat, 'longitude': lon, 'situacoes': situacoes,
+        })
+
+    if invalidos:
+        return jsonify(erro='Preencha nome da rua, número e bairro.', itens_invalidos=invalidos), 400
+
+    try:
+        # executemany: o SQLAlchemy agrupa as linhas em INSERTs multi-VALUES (insertmanyvalues)
+        if linhas:
+            db.session.execute(insert(Solicitacao), linhas)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        app.logger.exception("Erro ao salvar lote no banco")
+        return jsonify(erro=f'{type(e).__name__}: {e}'), 500
+
+    return jsonify(inseridos=len(linhas))
+
+# linhas da listagem formatadas no próprio Postgres (sem objetos ORM por linha).
+# Só as colunas exibidas são lidas; ORDER BY id DESC usa a PK (varredura reversa),
+# sem índice extra: um INCLUDE com foto_path/situacoes (TEXT) duplicaria a tabela
+# e falharia em textos acima do limite de tamanho de linha do btree.
+LISTA_SQL = text(f'''
+    SELECT id || ' - ' || nome_rua || ', ' || numero || ' - ' || bairro
+        || ' | loc: ' || COALESCE(latitude::text || ',' || longitude::text, '-')
+        || ' | foto: ' || COALESCE(NULLIF(foto_path, ''), '-')
+        || ' | situações: ' || COALESCE(NULLIF(array_to_string(situacoes, ','), ''), '-')
+    FROM "{DB_SCHEMA}"."{TABLE_NAME}"
+    ORDER BY id DESC
+''')
+LISTA_LOTE = 500  # linhas por lote do cursor no servidor
+
 @app.route('/lista')
 def lista():
-    itens = Solicitacao.query.order_by(Solicitacao.id.desc()).all()
-    linhas = []
-    for i in itens:
-        loc = f"{i.latitude},{i.longitude}" if (i.latitude is not None and i.longitude is not None) else "-"
-        foto = i.foto_path or "-"
-        linhas.append(f"{i.id} - {i.rua}, {i.numero} - {i.bairro} | loc: {loc} | foto: {foto} | situações: {i.situacoes or '-'}")
-    return '<br>'.join(linhas) or 'Sem registros.'
+    def gerar():
+        # cursor no servidor: memória O(lote) e o primeiro bloco sai antes do fim da varredura
+        result = db.session.execute(LISTA_SQL, execution_options={'yield_per': LISTA_LOTE})
+        sep = ''
+        for lote in result.scalars().partitions(LISTA_LOTE):
+            yield sep + '<br>'.join(lote)
+            sep = '<br>'
+        if not sep:
+            yield 'Sem registros.'
+    return Response(stream_with_context(gerar()), mimetype='text/html')
 
 # Diagnóstico rápido de encoding
-@app.route('/debug-enc')
-def debug_enc():
+# os valores são os mesmos para toda conexão do pool (fixados no connect/set_client_encoding):
+# consulta uma vez por processo; exceções não entram no cache e a próxima chamada tenta de novo
+@lru_cache(maxsize=1)
+def info_encoding() -> str:
     with db.engine.connect() as conn:
         client = conn.execute(text("SHOW client_encoding")).scalar_one()
         server = conn.execute(text("SHOW server_encoding")).scalar_one()
@@ -235,28 +408,79 @@ def debug_enc():
             lc_messages = 'desconhecido'
     return f"db={dbname}, client_encoding={client}, server_encoding={server}, lc_messages={lc_messages}, forced={CLIENT_ENCODING}"
 
+@app.route('/debug-enc')
+def debug_enc():
+    return info_encoding()
+
+# DDL do schema montada uma vez na importação (nomes de schema/tabela não aceitam bind)
+DDL_CREATE_SCHEMA = text(f'CREATE SCHEMA IF NOT EXISTS "{DB_SCHEMA}"')
+DDL_CREATE_TABLE = text(f'''
+    CREATE TABLE IF NOT EXISTS "{DB_SCHEMA}"."{TABLE_NAME}" (
+        id BIGSERIAL PRIMARY KEY,
+        nome_rua VARCHAR(120) NOT NULL,
+        numero   VARCHAR(10)  NOT NULL,
+        bairro   VARCHAR(80)  NOT NULL
+    )
+''')
+DDL_ALTER_TABLE = text(f'''
+    ALTER TABLE "{DB_SCHEMA}"."{TABLE_NAME}"
+    ADD COLUMN IF NOT EXISTS latitude   NUMERIC(9,6),
+    ADD COLUMN IF NOT EXISTS longitude  NUMERIC(9,6),
+    ADD COLUMN IF NOT EXISTS foto_path  TEXT,
+    ADD COLUMN IF NOT EXISTS situacoes  TEXT[],
+    ADD COLUMN IF NOT EXISTS criado_em  TIMESTAMPTZ DEFAULT NOW()
+''')
+# bases antigas guardavam situacoes como CSV em TEXT: converte uma vez para TEXT[]
+DDL_SITUACOES_ARRAY = text(f'''
+    DO $$
+    BEGIN
+        IF EXISTS (
+            SELECT 1 FROM information_schema.columns
+            WHERE table_schema = '{DB_SCHEMA}' AND table_name = '{TABLE_NAME}'
+              AND column_name = 'situacoes' AND data_type = 'text'
+        ) THEN
+            ALTER TABLE "{DB_SCHEMA}"."{TABLE_NAME}"
+            ALTER COLUMN situacoes TYPE TEXT[] USING string_to_array(NULLIF(situacoes, ''), ',');
+        END IF;
+    END
+    $$
+''')
+# GIN: filtros como situacoes @> ARRAY['buraco'] usam índice em vez de LIKE/split por linha
+INDICE_SITUACOES = f'ix_{TABLE_NAME}_situacoes_gin'
+DDL_INDICE_SITUACOES = text(f'''
+    CREATE INDEX IF NOT EXISTS "{INDICE_SITUACOES}"
+    ON "{DB_SCHEMA}"."{TABLE_NAME}" USING GIN (situacoes)
+''')
+DDL_SCHEMA = (DDL_CREATE_SCHEMA, DDL_CREATE_TABLE, DDL_ALTER_TABLE,
+              DDL_SITUACOES_ARRAY, DDL_INDICE_SITUACOES)
+
+SCHEMA_EM_DIA_SQL = text('''
+    SELECT count(*) FILTER (WHERE column_name = ANY(:colunas)),
+           COALESCE(bool_or(column_name = 'situacoes' AND data_type = 'ARRAY'), false),
+           to_regclass(:indice) IS NOT NULL
+    FROM information_schema.columns
+    WHERE table_schema = :schema AND table_name = :tabela
+''')
+
+# colunas acrescentadas pelo ALTER do início; presentes todas (situacoes já TEXT[] e
+# com o índice GIN) = schema em dia
+COLUNAS_GARANTIDAS = ['latitude', 'longitude', 'foto_path', 'situacoes', 'criado_em']
+
+def schema_em_dia(conn) -> bool:
+    # uma única consulta ao catálogo no lugar das DDLs a cada partida (inclusive no auto-reload)
+    n, situacoes_array, tem_indice = conn.execute(SCHEMA_EM_DIA_SQL, {
+        'schema': DB_SCHEMA, 'tabela': TABLE_NAME, 'colunas': COLUNAS_GARANTIDAS,
+        'indice': f'"{DB_SCHEMA}"."{INDICE_SITUACOES}"',
+    }).one()
+    return n == len(COLUNAS_GARANTIDAS) and situacoes_array and tem_indice
+
 if __name__ == '__main__':
     # Garante que schema/tabela/colunas existam
     with app.app_context():
         with db.engine.begin() as conn:
-            conn.execute(text(f'CREATE SCHEMA IF NOT EXISTS "{DB_SCHEMA}"'))
-            conn.execute(text(f'''
-                CREATE TABLE IF NOT EXISTS "{DB_SCHEMA}"."{TABLE_NAME}" (
-                    id BIGSERIAL PRIMARY KEY,
-                    nome_rua VARCHAR(120) NOT NULL,
-                    numero   VARCHAR(10)  NOT NULL,
-                    bairro   VARCHAR(80)  NOT NULL
-                )
-            '''))
-            conn.execute(text(f'''
-                ALTER TABLE "{DB_SCHEMA}"."{TABLE_NAME}"
-                ADD COLUMN IF NOT EXISTS latitude   NUMERIC(9,6),
-                ADD COLUMN IF NOT EXISTS longitude  NUMERIC(9,6),
-                ADD COLUMN IF NOT EXISTS foto_path  TEXT,
-                ADD COLUMN IF NOT EXISTS situacoes  TEXT,
-                ADD COLUMN IF NOT EXISTS criado_em  TIMESTAMPTZ DEFAULT NOW()
-            '''))
-        db.create_all()
-
+            if not schema_em_dia(conn):
+                for ddl in DDL_SCHEMA:
+                    conn.execute(ddl)
+        # sem db.create_all(): a DDL acima já cria a única tabela do modelo
 
     app.run(debug=True)